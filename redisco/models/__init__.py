@@ -1,9 +1,12 @@
 from .base import *
 from .attributes import *
 from .exceptions import *
+from .query import *
+from .aggregates import *
 
 __all__ = ['Model', 'Attribute', 'BooleanField', 'IntegerField',
         'Counter', 'FloatField', 'DateTimeField', 'DateField',
         'ReferenceField', 'ListField', 'ValidationError', 'from_key',
         'ValidationError', 'MissingID', 'AttributeNotIndexed',
-        'FieldValidationError', 'BadKeyError']
+        'FieldValidationError', 'BadKeyError', 'Q', 'Sum', 'Avg',
+        'Min', 'Max']
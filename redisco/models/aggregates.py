@@ -0,0 +1,74 @@
+"""
+Aggregates computed by ``ModelSet.aggregate`` on numeric and date
+attributes.
+"""
+from .attributes import IntegerField, DateTimeField, DateField
+
+__all__ = ['Sum', 'Avg', 'Min', 'Max']
+
+
+class Aggregate(object):
+    """
+    Base class of the aggregates. ``stat`` is the statistic of the
+    sorted set index of the field the aggregate is computed from:
+    ``min``, ``max`` or ``sum`` (which comes with the count).
+    """
+    stat = None
+
+    def __init__(self, field):
+        self.field = field
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.field)
+
+    def result(self, descriptor, stats):
+        """
+        Return the value of the aggregate from the statistics of the
+        field, or None when no object has a value for it.
+        """
+        raise NotImplementedError
+
+
+class Min(Aggregate):
+    """The smallest value of the field."""
+    stat = 'min'
+
+    def result(self, descriptor, stats):
+        if stats['min'] is None:
+            return None
+        return descriptor.typecast_for_read(stats['min'])
+
+
+class Max(Aggregate):
+    """The largest value of the field."""
+    stat = 'max'
+
+    def result(self, descriptor, stats):
+        if stats['max'] is None:
+            return None
+        return descriptor.typecast_for_read(stats['max'])
+
+
+class Sum(Aggregate):
+    """The sum of the values of the field."""
+    stat = 'sum'
+
+    def result(self, descriptor, stats):
+        if not stats['count']:
+            return None
+        if isinstance(descriptor, IntegerField):
+            return int(round(stats['sum']))
+        return stats['sum']
+
+
+class Avg(Aggregate):
+    """The mean of the values of the field, as a float (or a date)."""
+    stat = 'sum'
+
+    def result(self, descriptor, stats):
+        if not stats['count']:
+            return None
+        avg = stats['sum'] / stats['count']
+        if isinstance(descriptor, (DateTimeField, DateField)):
+            return descriptor.typecast_for_read(avg)
+        return avg
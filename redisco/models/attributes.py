@@ -2,9 +2,10 @@
 """
 Defines the fields that can be added to redisco models.
 """
+import re
 import time
 import sys
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from dateutil.tz import tzutc, tzlocal
 from calendar import timegm
 from redisco.containers import List
@@ -14,6 +15,15 @@ __all__ = ['Attribute', 'CharField', 'ListField', 'DateTimeField',
         'DateField', 'ReferenceField', 'Collection', 'IntegerField',
         'FloatField', 'BooleanField', 'Counter', 'ZINDEXABLE']
 
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+# Format of the name of a partition of a DateTimeField index and its
+# longest length, in seconds.
+_PARTITIONS = {'hour': ('%Y-%m-%dT%H', 3600),
+               'day': ('%Y-%m-%d', 86400),
+               'month': ('%Y-%m', 31 * 86400),
+               'year': ('%Y', 366 * 86400)}
+
 
 class Attribute(object):
     """Defines an attribute of the model.
@@ -26,6 +36,18 @@ class Attribute(object):
                      as the key to use when interacting with Redis.
         indexed   -- Index this attribute. Unindexed attributes cannot
                      be used in queries. Default: True.
+        lex_indexed -- Keep a lexicographic index of the attribute,
+                     used by the startswith, lt, lte, gt and gte
+                     lookups of filter. Default: False.
+        fulltext  -- Index the words of the attribute so that it can be
+                     used by the search method of the manager.
+                     Default: False.
+        term_frequency -- Also count the occurrences of each word of
+                     a fulltext attribute, used to rank the results
+                     of search. Default: False.
+        facet     -- Keep the set of the distinct values of an indexed
+                     attribute, used by the facet method of the
+                     manager. Default: False.
         unique    -- validates the uniqueness of the value of the
                      attribute.
         validator -- a callable that can validate the value of the
@@ -39,13 +61,21 @@ class Attribute(object):
                  required=False,
                  validator=None,
                  unique=False,
-                 default=None):
+                 default=None,
+                 lex_indexed=False,
+                 fulltext=False,
+                 term_frequency=False,
+                 facet=False):
         self.name = name
         self.indexed = indexed
         self.required = required
         self.validator = validator
         self.default = default
         self.unique = unique
+        self.lex_indexed = lex_indexed
+        self.fulltext = fulltext
+        self.term_frequency = term_frequency
+        self.facet = facet
 
     def __get__(self, instance, owner):
         try:
@@ -61,6 +91,15 @@ class Attribute(object):
     def __set__(self, instance, value):
         setattr(instance, '_' + self.name, value)
 
+    def tokenize(self, value):
+        """
+        Returns the lowercased words of the value, as used by the
+        fulltext index.
+        """
+        if not isinstance(value, unicode):
+            value = unicode(value)
+        return _WORD.findall(value.lower())
+
     def typecast_for_read(self, value):
         """Typecasts the value for reading from Redis."""
         # The redis client encodes all unicode data to utf-8 by default.
@@ -103,16 +142,28 @@ class Attribute(object):
             raise FieldValidationError(errors)
 
     def validate_uniqueness(self, instance, val):
+        """
+        Checks the hash mapping the unique values of the attribute to
+        the ids of the objects, and the index of the value for the
+        objects saved before the hash was maintained.
+        """
         encoded = self.typecast_for_storage(val)
-        matches = instance.__class__.objects.filter(**{self.name: encoded})
-        if len(matches) > 0:
-            try:
-                instance_id = instance.id
-                no_id = False
-            except MissingID:
-                no_id = True
-            if (len(matches) != 1) or no_id or (matches.first().id != instance.id):
-                return (self.name, 'not unique',)
+        pipeline = instance.db.pipeline(transaction=False)
+        pipeline.hget(instance._key['_unique'][self.name], encoded)
+        if self.indexed:
+            pipeline.smembers(instance._index_key_for_attr_val(self.name,
+                                                               encoded))
+        results = pipeline.execute()
+        if results[0] is not None:
+            owners = set([results[0]])
+        elif self.indexed:
+            owners = results[1]
+        else:
+            owners = set()
+        if not instance.is_new():
+            owners.discard(instance.id)
+        if owners:
+            return (self.name, 'not unique',)
 
 
 class CharField(Attribute):
@@ -186,11 +237,49 @@ class FloatField(Attribute):
 
 
 class DateTimeField(Attribute):
+    """
+    Options
+        partition -- 'hour', 'day', 'month' or 'year': the sorted set
+                     index is split into one key per period of time
+                     (in UTC), so that range lookups only read the
+                     periods they cover and old periods can be dropped.
+                     Default: None.
+    """
 
-    def __init__(self, auto_now=False, auto_now_add=False, **kwargs):
+    def __init__(self, auto_now=False, auto_now_add=False, partition=None,
+                 **kwargs):
         super(DateTimeField, self).__init__(**kwargs)
         self.auto_now = auto_now
         self.auto_now_add = auto_now_add
+        if partition is not None and partition not in _PARTITIONS:
+            raise ValueError("partition should be one of %s." %
+                             ", ".join(sorted(_PARTITIONS)))
+        self.partition = partition
+
+    def partition_of(self, value):
+        """Returns the name of the partition holding ``value``."""
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=tzlocal())
+        fmt = _PARTITIONS[self.partition][0]
+        return value.astimezone(tzutc()).strftime(fmt)
+
+    def partition_bounds(self, name):
+        """Returns the timestamps of the start and the end of the
+        partition ``name``."""
+        fmt, length = _PARTITIONS[self.partition]
+        start = datetime.strptime(name, fmt)
+        if self.partition == 'month':
+            end = start.replace(year=start.year + start.month // 12,
+                                month=start.month % 12 + 1)
+        elif self.partition == 'year':
+            end = start.replace(year=start.year + 1)
+        else:
+            end = start + timedelta(seconds=length)
+        return timegm(start.timetuple()), timegm(end.timetuple())
+
+    def partition_length(self):
+        """Returns the longest length of a partition, in seconds."""
+        return _PARTITIONS[self.partition][1]
 
     def typecast_for_read(self, value):
         try:
@@ -270,13 +359,15 @@ class ListField(object):
                  indexed=True,
                  required=False,
                  validator=None,
-                 default=None):
+                 default=None,
+                 facet=False):
         self._target_type = target_type
         self.name = name
         self.indexed = indexed
         self.required = required
         self.validator = validator
         self.default = default or []
+        self.facet = facet
         from base import Model
         self._redisco_model = (isinstance(target_type, basestring) or
             issubclass(target_type, Model))
@@ -377,7 +468,8 @@ class ReferenceField(object):
                  required=False,
                  related_name=None,
                  default=None,
-                 validator=None):
+                 validator=None,
+                 facet=False):
         self._target_type = target_type
         self.name = name
         self.indexed = indexed
@@ -386,6 +478,7 @@ class ReferenceField(object):
         self._related_name = related_name
         self.validator = validator
         self.default = default
+        self.facet = facet
 
     def __set__(self, instance, value):
         """
@@ -8,6 +8,7 @@ from .key import Key
 from .managers import ManagerDescriptor, Manager
 from .exceptions import FieldValidationError, MissingID, BadKeyError, WatchError
 from .attributes import Counter
+from .scripts import run_script, UNIQUE
 
 __all__ = ['Model', 'from_key']
 
@@ -98,7 +99,7 @@ def _initialize_references(model_class, name, bases, attrs):
         if isinstance(v, ReferenceField):
             model_class._references[k] = v
             v.name = v.name or k
-            att = Attribute(name=v.attname)
+            att = Attribute(name=v.attname, facet=v.facet)
             h[v.attname] = att
             setattr(model_class, v.attname, att)
             refd = _initialize_referenced(model_class, v)
@@ -128,6 +129,32 @@ def _initialize_indices(model_class, name, bases, attrs):
             model_class._indices.append(k)
     if model_class._meta['indices']:
         model_class._indices.extend(model_class._meta['indices'])
+    # the attributes keeping the set of their distinct values
+    descriptors = dict(model_class._lists)
+    descriptors.update(model_class._attributes)
+    descriptors.update((k, v) for k, v in attrs.iteritems()
+                       if isinstance(v, Attribute))
+    model_class._facets = set(k for k in model_class._indices
+                              if getattr(descriptors.get(k), 'facet', False))
+    model_class._compound_indices = [tuple(atts) for atts in
+                                     model_class._meta['compound_indices'] or ()]
+    model_class._materialized_views = {}
+    for name, view in (model_class._meta['views'] or {}).iteritems():
+        filters, ordering = view if isinstance(view, tuple) else (view, None)
+        atts = set(filters)
+        for att in atts:
+            if att not in model_class._attributes and \
+                    att not in model_class._lists:
+                raise ValueError("View %s filters on %s, which is not an "
+                                 "attribute nor a list." % (name, att))
+        if ordering:
+            field = ordering.lstrip('-')
+            if not isinstance(model_class._attributes.get(field), ZINDEXABLE):
+                raise ValueError("View %s should be ordered on a numeric or "
+                                 "date attribute." % name)
+            atts.add(field)
+        model_class._materialized_views[name] = (dict(filters), ordering,
+                                                 atts)
 
 
 def _initialize_counters(model_class, name, bases, attrs):
@@ -175,6 +202,8 @@ class ModelOptions(object):
     ...     name = models.Attribute()
     ...     class Meta:
     ...         indices = ('full_name',)
+    ...         compound_indices = [('name', 'full_name')]
+    ...         views = {'named': {'name': 'x'}}
     ...         db = redis.Redis(host='localhost', port=29909)
 
     """
@@ -326,6 +355,10 @@ class Model(object):
         if _new:
             self._initialize_id()
         with Mutex(self):
+            taken = self._claim_unique_values()
+            if taken:
+                self._errors.append((taken, 'not unique'))
+                return False
             self._write(_new)
         return True
 
@@ -354,6 +387,7 @@ class Model(object):
         pipeline = self.db.pipeline()
         self._delete_from_indices(pipeline)
         self._delete_membership(pipeline)
+        self._claim_unique_values(pipeline, release=True)
         pipeline.delete(self.key())
         pipeline.execute()
 
@@ -453,8 +487,14 @@ class Model(object):
         """
         Setting the id for the object will fetch it from the datastorage.
         """
+        self._set_id(val, self.db.hgetall(self._key[str(val)]))
+
+    def _set_id(self, val, stored_attrs):
+        """
+        Sets the id of the instance and the values of the attributes
+        from ``stored_attrs``, the content of the hash of the object.
+        """
         self._id = str(val)
-        stored_attrs = self.db.hgetall(self.key())
         attrs = self.attributes.values()
         for att in attrs:
             if att.name in stored_attrs and not isinstance(att, Counter):
@@ -533,15 +573,22 @@ class Model(object):
         """Initializes the id of the instance."""
         self._id = str(self.db.incr(self._key['id']))
 
-    def _write(self, _new=False):
+    def _write(self, _new=False, pipeline=None):
         """Writes the values of the attributes to the datastore.
 
         This method also creates the indices and saves the lists
-        associated to the object.
+        associated to the object. When ``pipeline`` is given, the
+        commands are only queued on it.
         """
-        pipeline = self.db.pipeline()
+        execute = pipeline is None
+        if execute:
+            pipeline = self.db.pipeline()
         self._create_membership(pipeline)
-        self._update_indices(pipeline)
+        if _new:
+            # a new id is in no index yet
+            self._add_to_indices(pipeline)
+        else:
+            self._update_indices(pipeline)
         h = {}
         # attributes
         for k, v in self.attributes.iteritems():
@@ -583,7 +630,8 @@ class Model(object):
                     l.extend([item.id for item in values])
                 else:
                     l.extend(values)
-        pipeline.execute()
+        if execute:
+            pipeline.execute()
 
     ##############
     # Membership #
@@ -601,6 +649,30 @@ class Model(object):
         """
         Set(self._key['all'], pipeline=pipeline).remove(self.id)
 
+    def _claim_unique_values(self, pipeline=None, release=False):
+        """Claims the values of the unique attributes in the hashes
+        ``Model:_unique:<att>`` and releases their previous values, or
+        only releases them when ``release`` is True.
+
+        Returns the name of an attribute whose value belongs to another
+        object, in which case nothing is claimed, or None. The script is
+        only queued when ``pipeline`` is given.
+        """
+        atts = sorted(att for att, desc in self.attributes.iteritems()
+                      if desc.unique)
+        if not atts:
+            return None
+        keys = [self._key['_unique'][att] for att in atts] + [self.key()]
+        args = [self.id]
+        for att in atts:
+            value = getattr(self, att)
+            args.append(att)
+            if value and not release:
+                args.append(self.attributes[att].typecast_for_storage(value))
+            else:
+                args.append('')
+        return run_script(self.db, UNIQUE, keys, args, client=pipeline)
+
     ############
     # INDICES! #
     ############
@@ -610,49 +682,231 @@ class Model(object):
         self._delete_from_indices(pipeline)
         self._add_to_indices(pipeline)
 
-    def _add_to_indices(self, pipeline):
-        """Adds the base64 encoded values of the indices."""
+    def _add_to_indices(self, pipeline, atts=None):
+        """Adds the base64 encoded values of the indices.
+
+        When ``atts`` is given, only the indices of these attributes
+        (and the compound indices and views they are part of) are
+        written.
+        """
         for att in self.indices:
-            self._add_to_index(att, pipeline=pipeline)
+            if atts is None or att in atts:
+                self._add_to_index(att, pipeline=pipeline)
+        for att, descriptor in self._attributes.iteritems():
+            if atts is not None and att not in atts:
+                continue
+            if descriptor.lex_indexed:
+                self._add_to_lex_index(att, pipeline=pipeline)
+            if descriptor.fulltext:
+                self._add_to_fulltext_index(att, pipeline=pipeline)
+        for compound in self._compound_indices:
+            if atts is not None and not set(compound) & set(atts):
+                continue
+            index = self._compound_index_key_for(compound)
+            if index is not None:
+                pipeline.sadd(index, self.id)
+                pipeline.sadd(self.key()['_indices'], index)
+        views = self._materialized_views
+        for name, (filters, ordering, view_atts) in views.iteritems():
+            if atts is None or view_atts & set(atts):
+                self._add_to_view(name, pipeline)
 
     def _add_to_index(self, att, val=None, pipeline=None):
         """
         Adds the id to the index.
 
-        This also adds to the _indices set of the object.
+        This also adds to the _indices set of the object, and the value
+        to the set of the distinct values of the attribute when it is
+        declared with ``facet``.
         """
         index = self._index_key_for(att)
         if index is None:
             return
         t, index = index
+        prefix = len(self._key[att]) + 1
+        values = att in self._facets and self._key['_values'][att]
         if t == 'attribute':
             pipeline.sadd(index, self.id)
             pipeline.sadd(self.key()['_indices'], index)
+            if values:
+                pipeline.sadd(values, index[prefix:])
         elif t == 'list':
             for i in index:
                 pipeline.sadd(i, self.id)
                 pipeline.sadd(self.key()['_indices'], i)
+                if values:
+                    pipeline.sadd(values, i[prefix:])
         elif t == 'sortedset':
             zindex, index = index
             pipeline.sadd(index, self.id)
             pipeline.sadd(self.key()['_indices'], index)
+            if values:
+                pipeline.sadd(values, index[prefix:])
             descriptor = self.attributes[att]
             score = descriptor.typecast_for_storage(getattr(self, att))
             pipeline.zadd(zindex, self.id, score)
             pipeline.sadd(self.key()['_zindices'], zindex)
+            if isinstance(descriptor, DateTimeField) and descriptor.partition:
+                # the registry of the partitions, scored by their start
+                name = descriptor.partition_of(getattr(self, att))
+                pipeline.zadd(self._key[att]['_partitions'], name,
+                              descriptor.partition_bounds(name)[0])
+
+    def _add_to_lex_index(self, att, pipeline):
+        """
+        Adds the value of the attribute to its lexicographic index: a
+        sorted set whose members (all of score 0) are the value and the
+        id separated by a NUL character.
+
+        The member is kept in the _lexindices hash of the object.
+        """
+        member = self._lex_member_for(att)
+        if member is None:
+            return
+        index = self._key['_lex'][att]
+        pipeline.zadd(index, member, 0)
+        pipeline.hset(self.key()['_lexindices'], index, member)
+
+    def _add_to_view(self, name, pipeline):
+        """
+        Adds the id to the set of the view if the object matches its
+        filters (a list matches when it holds the value) and, when the
+        view is ordered, to its sorted set with
+        the value of the ordering attribute as score. Objects without
+        a value for this attribute are left out of ordered views.
+        """
+        filters, ordering, atts = self._materialized_views[name]
+        for att, value in filters.iteritems():
+            if att in self.lists:
+                # a member of the list, as with filter
+                index = self._index_key_for(att)
+                if index is None or self._key[att][value] not in index[1]:
+                    return
+                continue
+            descriptor = self.attributes[att]
+            current = getattr(self, att)
+            if current is None or (descriptor.typecast_for_storage(current) !=
+                                   descriptor.typecast_for_storage(value)):
+                return
+        view = self._key['_view'][name]
+        if ordering:
+            field = ordering.lstrip('-')
+            value = getattr(self, field)
+            if value is None:
+                return
+            score = self.attributes[field].typecast_for_storage(value)
+            pipeline.zadd(view['sorted'], self.id, score)
+            pipeline.sadd(self.key()['_zindices'], view['sorted'])
+        pipeline.sadd(view, self.id)
+        pipeline.sadd(self.key()['_indices'], view)
+
+    def _lex_member_for(self, att):
+        """Returns the member of the lexicographic index of the
+        attribute for the value of the object, or None."""
+        value = getattr(self, att)
+        if value is None:
+            return None
+        descriptor = self.attributes[att]
+        return u"%s\0%s" % (descriptor.typecast_for_storage(value), self.id)
+
+    def _add_to_fulltext_index(self, att, pipeline):
+        """
+        Adds the id of the object to the set of each word of the
+        attribute and, when the attribute keeps the term frequencies,
+        to the sorted set of each word with the number of occurrences
+        of the word as score.
+        """
+        descriptor = self.attributes[att]
+        for term, n in self._terms_for(att).iteritems():
+            index = self._key['_ft'][att][term]
+            pipeline.sadd(index, self.id)
+            pipeline.sadd(self.key()['_indices'], index)
+            if descriptor.term_frequency:
+                zindex = self._key['_tf'][att][term]
+                pipeline.zadd(zindex, self.id, n)
+                pipeline.sadd(self.key()['_zindices'], zindex)
+
+    def _terms_for(self, att):
+        """Returns the number of occurrences of each word of the
+        value of the attribute."""
+        value = getattr(self, att)
+        counts = {}
+        if value is not None:
+            for term in self.attributes[att].tokenize(value):
+                counts[term] = counts.get(term, 0) + 1
+        return counts
+
+    def _delete_from_indices_of(self, atts, pipeline):
+        """Removes the object from the indices of the attributes
+        ``atts`` (and the compound indices and views they are part of)
+        for their current values. This is the counterpart of
+        ``_add_to_indices(pipeline, atts)``, used to change some
+        attributes without saving the whole object.
+        """
+        indices = self.key()['_indices']
+        for att in atts:
+            descriptor = self._attributes[att]
+            index = att in self.indices and self._index_key_for(att)
+            if index:
+                t, index = index
+                if t == 'sortedset':
+                    zindex, index = index
+                    pipeline.zrem(zindex, self.id)
+                    pipeline.srem(self.key()['_zindices'], zindex)
+                pipeline.srem(index, self.id)
+                pipeline.srem(indices, index)
+            if descriptor.lex_indexed:
+                member = self._lex_member_for(att)
+                if member is not None:
+                    pipeline.zrem(self._key['_lex'][att], member)
+                    pipeline.hdel(self.key()['_lexindices'],
+                                  self._key['_lex'][att])
+            if descriptor.fulltext:
+                for term in self._terms_for(att):
+                    index = self._key['_ft'][att][term]
+                    pipeline.srem(index, self.id)
+                    pipeline.srem(indices, index)
+                    if descriptor.term_frequency:
+                        zindex = self._key['_tf'][att][term]
+                        pipeline.zrem(zindex, self.id)
+                        pipeline.srem(self.key()['_zindices'], zindex)
+        for compound in self._compound_indices:
+            if set(compound) & set(atts):
+                index = self._compound_index_key_for(compound)
+                if index is not None:
+                    pipeline.srem(index, self.id)
+                    pipeline.srem(indices, index)
+        views = self._materialized_views
+        for name, (filters, ordering, view_atts) in views.iteritems():
+            if view_atts & set(atts):
+                view = self._key['_view'][name]
+                pipeline.srem(view, self.id)
+                pipeline.srem(indices, view)
+                if ordering:
+                    pipeline.zrem(view['sorted'], self.id)
+                    pipeline.srem(self.key()['_zindices'], view['sorted'])
 
     def _delete_from_indices(self, pipeline):
         """Deletes the object's id from the sets(indices) it has been added
         to and removes its list of indices (used for housekeeping).
         """
-        s = Set(self.key()['_indices'], pipeline=self.db)
-        z = Set(self.key()['_zindices'], pipeline=self.db)
-        for index in s.members:
+        s = Set(self.key()['_indices'])
+        z = Set(self.key()['_zindices'])
+        l = self.key()['_lexindices']
+        reads = self.db.pipeline()
+        reads.smembers(s.key)
+        reads.smembers(z.key)
+        reads.hgetall(l)
+        indices, zindices, lexindices = reads.execute()
+        for index in indices:
             pipeline.srem(index, self.id)
-        for index in z.members:
+        for index in zindices:
             pipeline.zrem(index, self.id)
+        for index, member in lexindices.iteritems():
+            pipeline.zrem(index, member)
         pipeline.delete(s.key)
         pipeline.delete(z.key)
+        pipeline.delete(l)
 
     def _index_key_for(self, att, value=None):
         """Returns a key based on the attribute and its value.
@@ -670,6 +924,27 @@ class Model(object):
         else:
             return self._tuple_for_index_key_attr_list(att, value)
 
+    def _compound_index_key_for(self, atts):
+        """Returns the key of the compound index of the attributes
+        for the values of the object, or None when one of them has
+        no value. Each value is prefixed by its length.
+        """
+        key = self._key['+'.join(atts)]
+        for att in atts:
+            value = getattr(self, att)
+            if callable(value):
+                value = value()
+            if value is None:
+                return None
+            descriptor = self.attributes.get(att)
+            if descriptor:
+                value = descriptor.typecast_for_storage(value)
+            else:
+                value = unicode(value)
+            # prefixed by its length: values may contain ':'
+            key = key[len(value)][value]
+        return key
+
     def _get_index_key_for_non_list_attr(self, att, value):
         descriptor = self.attributes.get(att)
         if descriptor and isinstance(descriptor, ZINDEXABLE):
@@ -689,8 +964,12 @@ class Model(object):
         return ('list', [self._index_key_for_attr_val(att, e) for e in val])
 
     def _tuple_for_index_key_attr_zset(self, att, val, sval):
+        zindex = self._key[att]
+        descriptor = self.attributes[att]
+        if isinstance(descriptor, DateTimeField) and descriptor.partition:
+            zindex = zindex['_p'][descriptor.partition_of(val)]
         return ('sortedset',
-                (self._key[att], self._index_key_for_attr_val(att, sval)))
+                (zindex, self._index_key_for_attr_val(att, sval)))
 
     def _index_key_for_attr_val(self, att, val):
         return self._key[att][val]
@@ -235,6 +235,594 @@ class ModelTestCase(RediscoTestCase):
         self.assertEqual(3, len(persons))
 
 
+    def test_in_lookup(self):
+        from redisco.models import Q
+        Person.objects.create(first_name="Granny", last_name="Goose")
+        Person.objects.create(first_name="Clark", last_name="Kent")
+        Person.objects.create(first_name="Granny", last_name="Mommy")
+        Person.objects.create(first_name="Lois", last_name="Lane")
+        Person.objects.create(first_name="Granny", last_name="Kent")
+
+        def ids(qs):
+            return [p.id for p in qs]
+
+        self.assertEqual(['2', '4'], ids(Person.objects.filter(
+                first_name__in=["Clark", "Lois", "Lana"])))
+        self.assertEqual(['1', '3', '5'], ids(Person.objects.exclude(
+                first_name__in=["Clark", "Lois"])))
+        self.assertEqual(['1', '5'], ids(Person.objects.filter(
+                first_name__in=["Granny"],
+                last_name__in=["Goose", "Kent"])))
+        self.assertEqual([], ids(Person.objects.filter(first_name__in=[])))
+        self.assertEqual(['1', '2', '3', '4', '5'],
+                ids(Person.objects.exclude(first_name__in=[])))
+        self.assertEqual(['2', '4', '5'], ids(Person.objects.filter(
+                Q(first_name__in=["Clark", "Lois"]) | Q(last_name="Kent"))))
+        self.assertFalse(self.client.keys('~Person:all:*'))
+        self.assertRaises(ValueError,
+                ids, Person.objects.filter(first_name__foo="Granny"))
+
+    def test_q_lookups(self):
+        from redisco.models import Q
+        Person.objects.create(first_name="Granny", last_name="Goose")
+        Person.objects.create(first_name="Clark", last_name="Kent")
+        Person.objects.create(first_name="Granny", last_name="Mommy")
+        Person.objects.create(first_name="Lois", last_name="Lane")
+        Person.objects.create(first_name="Granny", last_name="Kent")
+
+        def ids(*args, **kwargs):
+            return [p.id for p in Person.objects.filter(*args, **kwargs)]
+
+        self.assertEqual(['2', '4', '5'],
+                ids(Q(last_name="Kent") | Q(first_name="Lois")))
+        self.assertEqual(['2', '4'],
+                ids((Q(last_name="Kent") | Q(first_name="Lois")) &
+                    ~Q(first_name="Granny")))
+        self.assertEqual(['2', '4'],
+                ids(~Q(first_name="Granny")))
+        self.assertEqual(['1', '2', '4', '5'],
+                ids(~Q(first_name="Granny") | Q(last_name="Goose") |
+                    Q(last_name="Kent")))
+        self.assertEqual(['4'],
+                ids(~(Q(first_name="Granny") | Q(last_name="Kent"))))
+        self.assertEqual(['1', '3'],
+                ids(Q(first_name="Granny"), ~Q(last_name="Kent")))
+        self.assertEqual(['1', '3', '4'],
+                ids(~Q(last_name="Kent")))
+        self.assertEqual(['3', '5'],
+                [p.id for p in Person.objects.filter(first_name="Granny")
+                                             .exclude(Q(last_name="Goose"))])
+        self.assertEqual(['3'],
+                ids(Q(first_name="Granny", last_name="Mommy") |
+                    Q(first_name="Lana")))
+        self.assertEqual(5, len(ids(Q())))
+        self.assertRaises(models.AttributeNotIndexed,
+                ids, Q(nickname="Smallville"))
+        # the intermediate keys are removed
+        self.assertFalse(self.client.keys('~Person:all:q*'))
+
+    def test_lex_lookups(self):
+        class City(models.Model):
+            name = models.Attribute(lex_indexed=True)
+            country = models.Attribute()
+
+        for name, country in ((u"Paris", "FR"), (u"Parma", "IT"),
+                              (u"Par", "XX"), (u"Pau", "FR"),
+                              (u"Z\xfcrich", "CH"), (u"Berlin", "DE")):
+            City.objects.create(name=name, country=country)
+
+        def names(**kwargs):
+            return sorted(c.name for c in City.objects.filter(**kwargs))
+
+        self.assertEqual([u"Par", u"Paris", u"Parma"],
+                         names(name__startswith="Par"))
+        self.assertEqual([u"Paris", u"Parma"],
+                         names(name__startswith="Par", country__in=["FR", "IT"]))
+        self.assertEqual([u"Z\xfcrich"], names(name__startswith=u"Z\xfc"))
+        self.assertEqual([u"Berlin", u"Par"], names(name__lt="Paris"))
+        self.assertEqual([u"Berlin", u"Par", u"Paris"], names(name__lte="Paris"))
+        self.assertEqual([u"Parma", u"Pau", u"Z\xfcrich"], names(name__gt="Paris"))
+        self.assertEqual([u"Paris", u"Parma", u"Pau", u"Z\xfcrich"],
+                         names(name__gte="Paris"))
+        self.assertEqual([u"Pau"], [c.name for c in City.objects.exclude(
+                name__startswith="Par").filter(country="FR")])
+
+        paris = City.objects.filter(name="Paris").first()
+        paris.name = u"Lutece"
+        paris.save()
+        self.assertEqual([u"Par", u"Parma"], names(name__startswith="Par"))
+        self.assertEqual([u"Lutece"], names(name__startswith="Lu"))
+        paris.delete()
+        self.assertEqual([], names(name__startswith="Lu"))
+        self.assertEqual(5, self.client.zcard(City._key['_lex']['name']))
+        self.assertRaises(models.AttributeNotIndexed,
+                          names, country__startswith="F")
+        self.assertFalse(self.client.keys('~City:all:*'))
+
+    def test_search(self):
+        class Product(models.Model):
+            title = models.Attribute(fulltext=True, term_frequency=True)
+            description = models.Attribute(fulltext=True)
+            shop = models.Attribute()
+
+        Product.objects.create(title=u"Quick fox", description=u"brown",
+                               shop="a")
+        Product.objects.create(title=u"Brown dog", description=u"quick, quick",
+                               shop="b")
+        Product.objects.create(title=u"Fox fox fox", description=u"lazy",
+                               shop="a")
+        Product.objects.create(title=u"Caf\xe9", shop="b")
+
+        def ids(qs):
+            return [p.id for p in qs]
+
+        self.assertEqual(['1', '2'], ids(Product.objects.search("quick brown")))
+        self.assertEqual([], ids(Product.objects.search("quick brown",
+                                                        fields=['title'])))
+        self.assertEqual(['2'], ids(Product.objects.search("brown",
+                                                           fields=['title'])))
+        self.assertEqual(['1', '3'], ids(Product.objects.search("fox")))
+        self.assertEqual(['3'], ids(Product.objects.search("fox lazy")))
+        self.assertEqual(['4'], ids(Product.objects.search(u"CAF\xc9")))
+        self.assertEqual([], ids(Product.objects.search("wolf")))
+        self.assertEqual([], ids(Product.objects.search("  ")))
+        self.assertEqual(['2'], ids(Product.objects.filter(shop="b")
+                                                   .search("quick")))
+        self.assertEqual(['1'], ids(Product.objects.exclude(shop="b")
+                                                   .search("quick")))
+        self.assertEqual(2, Product.objects.search("fox").count())
+
+        # ranked by the occurrences in the title and the matching
+        # descriptions
+        self.assertEqual(['3', '1'],
+                         ids(Product.objects.search("fox", rank=True)))
+        self.assertEqual(['3', '1'], ids(Product.objects.search(
+                "fox", rank=True).iterator()))
+        self.assertEqual(['1', '2'], ids(Product.objects.search(
+                "quick", fields={'title': 3, 'description': 1}, rank=True)))
+        self.assertEqual(['2', '1'], ids(Product.objects.search(
+                "quick", fields={'title': 1, 'description': 5}, rank=True)))
+        self.assertEqual(['3'], ids(Product.objects.search(
+                "fox", rank=True).limit(1)))
+        self.assertEqual(['1', '3'], ids(Product.objects.search(
+                "fox", rank=True).order('shop')))
+
+        p = Product.objects.get_by_id('3')
+        p.title = u"Wolf"
+        p.save()
+        self.assertEqual(['1'], ids(Product.objects.search("fox")))
+        self.assertEqual(['3'], ids(Product.objects.search("wolf")))
+        p.delete()
+        self.assertEqual([], ids(Product.objects.search("wolf")))
+        self.assertFalse(self.client.exists(Product._key['_ft']['title']['wolf']))
+        self.assertFalse(self.client.exists(Product._key['_tf']['title']['wolf']))
+
+        self.assertRaises(models.AttributeNotIndexed,
+                          Product.objects.search, "a", fields=['shop'])
+        self.assertRaises(models.AttributeNotIndexed,
+                          Person.objects.search, "a")
+        self.assertFalse(self.client.keys('~Product:all:*'))
+
+    def test_compound_indices(self):
+        class Ticket(models.Model):
+            tenant = models.Attribute()
+            status = models.Attribute()
+            priority = models.IntegerField()
+
+            class Meta:
+                compound_indices = [('tenant', 'status')]
+
+        for tenant, status, priority in (("a", "open", 1), ("a", "closed", 2),
+                                         ("b", "open", 3), ("a", "open", 4)):
+            Ticket.objects.create(tenant=tenant, status=status,
+                                  priority=priority)
+        Ticket.objects.create(tenant="a")
+        self.assertEqual(set(['1', '4']),
+                         self.client.smembers('Ticket:tenant+status:1:a:4:open'))
+        self.assertFalse(self.client.keys('Ticket:tenant+status:1:a:4:None'))
+
+        def ids(qs):
+            return [t.id for t in qs]
+
+        self.assertEqual(['1', '4'], ids(Ticket.objects.filter(
+                tenant="a", status="open")))
+        self.assertEqual(['4'], ids(Ticket.objects.filter(
+                tenant="a", status="open", priority=4)))
+        self.assertEqual(['4', '1'], ids(Ticket.objects.filter(
+                tenant="a", status="open").order('-priority')))
+        self.assertEqual(['1'], ids(Ticket.objects.filter(
+                tenant="a", status="open").exclude(priority=4)))
+        self.assertEqual(['4'], ids(Ticket.objects.filter(
+                tenant="a", status="open").zfilter(priority__gt=2)))
+        self.assertEqual(2, Ticket.objects.filter(
+                tenant="a", status="open").count())
+        self.assertEqual(['1'], ids(Ticket.objects.filter(
+                tenant="a", status="open").unordered().limit(1)))
+        self.assertEqual(['1', '3', '4'], ids(Ticket.objects.filter(
+                tenant__in=["a", "b"], status="open")))
+
+        t = Ticket.objects.get_by_id('1')
+        t.status = "closed"
+        t.save()
+        self.assertEqual(['4'], ids(Ticket.objects.filter(
+                tenant="a", status="open")))
+        self.assertEqual(['1', '2'], ids(Ticket.objects.filter(
+                tenant="a", status="closed")))
+        t.delete()
+        self.assertEqual(['2'], ids(Ticket.objects.filter(
+                tenant="a", status="closed")))
+        # the indices used as looked-up sets do not expire
+        for key in ('Ticket:tenant+status:1:a:6:closed',
+                    'Ticket:tenant+status:1:a:4:open'):
+            self.assertTrue(self.client.exists(key))
+            self.assertEqual(None, self.client.ttl(key))
+
+        # the values are delimited even when they contain ':'
+        a = Ticket.objects.create(tenant="x", status="y:z")
+        b = Ticket.objects.create(tenant="x:y", status="z")
+        self.assertEqual([a.id], ids(Ticket.objects.filter(
+                tenant="x", status="y:z")))
+        self.assertEqual([b.id], ids(Ticket.objects.filter(
+                tenant="x:y", status="z")))
+
+    def test_aggregate(self):
+        from redisco.models import Sum, Avg, Min, Max
+
+        class Order(models.Model):
+            shop = models.Attribute()
+            amount = models.IntegerField()
+            weight = models.FloatField()
+            day = models.DateField()
+            visits = models.Counter()
+
+        for shop, amount, weight, day in (("a", 10, 1.5, date(2020, 1, 3)),
+                                          ("a", -4, 2.0, date(2020, 1, 1)),
+                                          ("b", 7, 0.25, date(2020, 1, 2)),
+                                          ("a", None, None, None)):
+            Order.objects.create(shop=shop, amount=amount, weight=weight,
+                                 day=day)
+
+        res = Order.objects.filter(shop="a").aggregate(
+                total=Sum('amount'), avg=Avg('amount'), low=Min('amount'),
+                high=Max('amount'), weight=Sum('weight'),
+                first=Min('day'), last=Max('day'))
+        self.assertEqual({'total': 6, 'avg': 3.0, 'low': -4, 'high': 10,
+                          'weight': 3.5, 'first': date(2020, 1, 1),
+                          'last': date(2020, 1, 3)}, res)
+        self.assertEqual({'avg': 1.25},
+                         Order.objects.aggregate(avg=Avg('weight')))
+        self.assertEqual({'total': None, 'high': None},
+                         Order.objects.filter(shop="c").aggregate(
+                             total=Sum('amount'), high=Max('amount')))
+        self.assertRaises(models.AttributeNotIndexed,
+                          Order.objects.aggregate, total=Sum('visits'))
+        self.assertRaises(models.AttributeNotIndexed,
+                          Order.objects.aggregate, total=Sum('shop'))
+        self.assertRaises(ValueError,
+                          Order.objects.all().limit(1).aggregate,
+                          total=Sum('amount'))
+        self.assertFalse(self.client.keys('~*aggregate*'))
+
+    def test_facet(self):
+        class Shirt(models.Model):
+            color = models.Attribute(facet=True)
+            size = models.IntegerField(facet=True)
+            tags = models.ListField(str, facet=True)
+            cheap = models.BooleanField(facet=True)
+            price = models.IntegerField()
+
+        Shirt.objects.create(color=u"r\xe9d", size=1, tags=["a", "b"],
+                             cheap=True)
+        Shirt.objects.create(color=u"blue", size=2, tags=["b"], cheap=False)
+        Shirt.objects.create(color=u"blue", size=2, tags=[], cheap=True)
+        Shirt.objects.create(size=3, price=10)
+
+        self.assertEqual({u"r\xe9d": 1, u"blue": 2},
+                         Shirt.objects.facet('color'))
+        self.assertEqual({1: 1, 2: 2, 3: 1}, Shirt.objects.facet('size'))
+        self.assertEqual({u"a": 1, u"b": 2}, Shirt.objects.facet('tags'))
+        self.assertEqual({u"r\xe9d": 1, u"blue": 1},
+                         Shirt.objects.filter(cheap=True).facet('color'))
+        self.assertEqual({True: 1, False: 1},
+                         Shirt.objects.filter(size=2).facet('cheap'))
+        self.assertEqual({2: 1}, Shirt.objects.filter(tags="b")
+                                              .exclude(color=u"r\xe9d")
+                                              .facet('size'))
+        self.assertEqual({}, Shirt.objects.filter(color="green").facet('size'))
+
+        shirt = Shirt.objects.get_by_id('1')
+        shirt.color = u"green"
+        shirt.save()
+        self.assertEqual({u"green": 1, u"blue": 2},
+                         Shirt.objects.facet('color'))
+        # the values left without any object are removed
+        self.assertEqual(set(["green", "blue"]),
+                         self.client.smembers(Shirt._key['_values']['color']))
+        self.assertRaises(models.AttributeNotIndexed,
+                          Person.objects.facet, 'nickname')
+        # only the attributes declared with facet keep their values
+        self.assertRaises(models.AttributeNotIndexed,
+                          Shirt.objects.facet, 'price')
+        self.assertFalse(self.client.exists(Shirt._key['_values']['price']))
+        self.assertFalse(self.client.keys('~*facet*'))
+
+    def test_explain(self):
+        Person.objects.create(first_name="Granny", last_name="Goose")
+        Person.objects.create(first_name="Clark", last_name="Kent")
+        Person.objects.create(first_name="Granny", last_name="Mommy")
+        Person.objects.create(first_name="Granny", last_name="Kent")
+
+        qs = Person.objects.filter(first_name="Granny").exclude(
+                last_name="Kent").order('-last_name').limit(1, 0)
+        plan = qs.explain(timings=True)
+        self.assertEqual(['all', 'filter', 'exclude', 'order'],
+                         [step['step'] for step in plan['steps']])
+        self.assertEqual([4, 3, 2, 1],
+                         [step['size'] for step in plan['steps']])
+        self.assertEqual('Person:all', plan['steps'][0]['key'])
+        self.assertEqual('Person:first_name:Granny', plan['steps'][1]['key'])
+        exclude = plan['steps'][2]
+        self.assertTrue(exclude['key'].startswith('~'))
+        self.assertEqual(1, exclude['round_trips'])
+        self.assertTrue(exclude['commands'][0].startswith(
+                u"SDIFFSTORE %s Person:first_name:Granny Person:last_name:Kent"
+                % exclude['key']))
+        order = plan['steps'][3]
+        self.assertEqual(1, order['round_trips'])
+        self.assertEqual(u"SORT %s BY Person:*->last_name LIMIT 0 1 DESC "
+                         u"ALPHA STORE %s" % (exclude['key'], order['key']),
+                         order['commands'][0])
+        self.assertEqual(2, plan['round_trips'])
+        self.assertTrue(all(step['time'] >= 0 for step in plan['steps']))
+        self.assertTrue(plan['time'] >= 0)
+        self.assertFalse(hasattr(qs, '_cached_set'))
+        self.assertEqual(['3'], [p.id for p in qs])
+        self.assertFalse('time' in Person.objects.all().explain())
+
+    def test_fast_membership(self):
+        from redisco.models import Q
+
+        class Ticket(models.Model):
+            tenant = models.Attribute()
+            status = models.Attribute()
+            priority = models.IntegerField()
+
+            class Meta:
+                compound_indices = [('tenant', 'status')]
+
+        for tenant, status, priority in (("a", "open", 1), ("a", "closed", 2),
+                                         ("b", "open", 3), ("a", "open", 4)):
+            Ticket.objects.create(tenant=tenant, status=status,
+                                  priority=priority)
+        tickets = [Ticket.objects.get_by_id(str(i)) for i in range(1, 5)]
+
+        querysets = [
+            Ticket.objects.all(),
+            Ticket.objects.filter(tenant="a"),
+            Ticket.objects.filter(tenant="a", status="open"),
+            Ticket.objects.filter(tenant="a", status="open", priority=4),
+            Ticket.objects.filter(status__in=["closed", "nope"]),
+            Ticket.objects.filter(status__in=[]),
+            Ticket.objects.exclude(status="open"),
+            Ticket.objects.exclude(priority__in=[1, 3]),
+            Ticket.objects.filter(tenant="a").exclude(priority=2),
+            Ticket.objects.zfilter(priority__gt=1),
+            Ticket.objects.zfilter(priority__lte=3).filter(tenant="a"),
+            Ticket.objects.zfilter(priority__in=(2, 3)),
+            Ticket.objects.filter(Q(tenant="b") | Q(priority=2)),
+        ]
+        for qs in querysets:
+            expected = set(t.id for t in qs._clone())
+            for t in tickets:
+                self.assertEqual(t.id in expected, t in qs)
+                self.assertEqual(t.id in expected,
+                                 qs.get_by_id(t.id) is not None)
+            self.assertFalse(hasattr(qs, '_cached_set'))
+        self.client.delete(*self.client.keys('~*'))
+        qs = Ticket.objects.filter(tenant="a").exclude(priority=2)
+        for t in tickets:
+            t in qs
+        # nothing is stored to answer
+        self.assertFalse(self.client.keys('~*'))
+        self.assertTrue(tickets[0] in Ticket.objects.all().limit(1))
+        self.assertFalse(tickets[1] in Ticket.objects.all().limit(1))
+        tickets[0].delete()
+        self.assertFalse(tickets[0] in Ticket.objects.filter(tenant="a"))
+
+    def test_bulk_update_waits_for_save(self):
+        class Task(models.Model):
+            status = models.Attribute()
+
+        task = Task.objects.create(status="new")
+        threads = []
+        read_indices = task._delete_from_indices
+
+        def delete_from_indices(pipeline):
+            # the indices of the object are read: update it meanwhile
+            read_indices(pipeline)
+            t = Thread(target=Task.objects.all().update,
+                       kwargs={'status': "done"})
+            t.start()
+            threads.append(t)
+            time.sleep(0.2)
+
+        task._delete_from_indices = delete_from_indices
+        task.save()
+        threads[0].join()
+        self.assertEqual("done", self.client.hget(task.key(), 'status'))
+        self.assertEqual(set(), self.client.smembers('Task:status:new'))
+        self.assertEqual(set([task.id]),
+                         self.client.smembers('Task:status:done'))
+        self.assertTrue(self.client.sismember(task.key()['_indices'],
+                                              'Task:status:done'))
+
+    def test_bulk_update(self):
+        class Item(models.Model):
+            name = models.Attribute(lex_indexed=True, fulltext=True,
+                                    term_frequency=True)
+            status = models.Attribute()
+            tenant = models.Attribute()
+            price = models.IntegerField()
+            note = models.Attribute(indexed=False)
+            code = models.Attribute(unique=True)
+            hits = models.Counter()
+
+            class Meta:
+                compound_indices = [('tenant', 'status')]
+
+        for i, (status, tenant, price) in enumerate(
+                (("new", "a", 5), ("new", "b", 7), ("old", "a", 9),
+                 ("new", "a", None))):
+            Item.objects.create(name=u"item %d" % i, status=status,
+                                tenant=tenant, price=price, note=u"x")
+
+        def dump():
+            res = {}
+            for key in self.client.keys('Item:*'):
+                if key.endswith(':id') or key.startswith('Item:_values'):
+                    continue
+                t = self.client.type(key)
+                if t == 'set':
+                    res[key] = self.client.smembers(key)
+                elif t == 'zset':
+                    res[key] = self.client.zrange(key, 0, -1, withscores=True)
+                elif t == 'hash':
+                    res[key] = self.client.hgetall(key)
+            return res
+
+        n = Item.objects.filter(status="new").exclude(tenant="b").update(
+                status="done", price=1, name=u"renamed thing", note=None)
+        self.assertEqual(2, n)
+        self.assertEqual(['1', '4'],
+                         [i.id for i in Item.objects.filter(status="done")])
+        self.assertEqual(['1', '4'], [i.id for i in Item.objects.filter(
+                tenant="a", status="done")])
+        self.assertEqual([], [i.id for i in Item.objects.filter(
+                tenant="a", status="new")])
+        self.assertEqual(['1', '4'],
+                         [i.id for i in Item.objects.zfilter(price__lt=2)])
+        self.assertEqual(['1', '4'],
+                         [i.id for i in Item.objects.search("thing")])
+        self.assertEqual(['1', '4'], [i.id for i in Item.objects.filter(
+                name__startswith="ren")])
+        self.assertEqual(None, Item.objects.get_by_id('1').note)
+        self.assertEqual(u"x", Item.objects.get_by_id('2').note)
+        self.assertEqual(u"new", Item.objects.get_by_id('2').status)
+
+        # the indices are the ones a save would write
+        before = dump()
+        for item in Item.objects.all():
+            item.save()
+        self.assertEqual(before, dump())
+
+        self.assertEqual(0, Item.objects.filter(status="nope").update(
+                status="x"))
+        self.assertRaises(ValueError, Item.objects.all().update, code="c")
+        self.assertRaises(ValueError, Item.objects.all().update, hits=1)
+        self.assertRaises(ValueError, Item.objects.all().update, nope=1)
+        self.assertRaises(models.FieldValidationError,
+                          Item.objects.all().update, price="cheap")
+
+        # an object without any value has no hash, but exists
+        class Flag(models.Model):
+            status = models.Attribute()
+
+        Flag.objects.create(status="a")
+        empty = Flag.objects.create()
+        self.assertFalse(self.client.exists(empty.key()))
+        self.assertEqual(2, Flag.objects.all().update(status="b"))
+        self.assertEqual("b", Flag.objects.get_by_id(empty.id).status)
+        self.assertEqual(2, len(Flag.objects.filter(status="b")))
+
+        # indices computed in Meta: the objects are saved
+        Person.objects.create(first_name="Granny", last_name="Goose")
+        Person.objects.create(first_name="Clark", last_name="Kent")
+        self.assertEqual(1, Person.objects.filter(first_name="Granny").update(
+                last_name="Mommy"))
+        self.assertEqual(['1'], [p.id for p in Person.objects.filter(
+                full_name="Granny Mommy")])
+
+    def test_bulk_delete(self):
+        class Item(models.Model):
+            name = models.Attribute(lex_indexed=True, fulltext=True,
+                                    term_frequency=True)
+            status = models.Attribute()
+            tenant = models.Attribute()
+            price = models.IntegerField()
+            tags = models.ListField(str)
+
+            class Meta:
+                compound_indices = [('tenant', 'status')]
+
+        for i, (status, tenant, price) in enumerate(
+                (("new", "a", 5), ("new", "b", 7), ("old", "a", 9),
+                 ("new", "a", None))):
+            Item.objects.create(name=u"item %d" % i, status=status,
+                                tenant=tenant, price=price, tags=["x", "y"])
+
+        def keys():
+            return set(k for k in self.client.keys('Item:*')
+                       if not k.startswith('Item:_values') and
+                       k != 'Item:id' and '#' not in k)
+
+        self.assertEqual(3, Item.objects.filter(status="new").delete())
+        self.assertEqual(['3'], [i.id for i in Item.objects.all()])
+        self.assertEqual(None, Item.objects.get_by_id('1'))
+        self.assertEqual([], [i.id for i in Item.objects.search("item")
+                                                        .exclude(status="old")])
+        self.assertFalse(self.client.exists('Item:1:tags'))
+        self.assertEqual(0, Item.objects.filter(status="new").delete())
+
+        # what is left is what deleting with Model.delete leaves
+        Item.objects.get_by_id('3').delete()
+        self.client.delete('Item:3:tags')
+        self.assertEqual(set(), keys())
+        self.assertEqual(0, Item.objects.all().delete())
+
+        Person.objects.create(first_name="Granny", last_name="Goose")
+        Person.objects.create(first_name="Clark", last_name="Kent")
+        self.assertEqual(1, Person.objects.all().limit(1).delete())
+        self.assertEqual(['2'], [p.id for p in Person.objects.all()])
+        self.assertEqual([], [p.id for p in Person.objects.filter(
+                full_name="Granny Goose")])
+
+    def test_slicing_pushdown(self):
+        for name in ("e", "a", "d", "b", "c"):
+            Person.objects.create(first_name=name)
+
+        def names(items):
+            return [p.first_name for p in items]
+
+        qs = Person.objects.order('first_name')
+        self.assertEqual(["b", "c"], names(qs[1:3]))
+        self.assertEqual(["a", "b"], names(qs[:2]))
+        self.assertEqual(["d", "e"], names(qs[3:]))
+        self.assertEqual([], names(qs[3:3]))
+        self.assertEqual([], names(qs[7:9]))
+        self.assertEqual("c", qs[2].first_name)
+        self.assertRaises(IndexError, qs.__getitem__, 5)
+        # the whole collection is not looked up
+        self.assertFalse(hasattr(qs, '_cached_set'))
+
+        limited = qs.limit(3, 1)
+        self.assertEqual(["c", "d"], names(limited[1:5]))
+        self.assertEqual(["b"], names(limited[:1]))
+        self.assertEqual([], names(limited[3:4]))
+        self.assertEqual(["c", "d"], names(limited[1:]))
+
+        # negative bounds and steps use the whole collection
+        self.assertEqual(["d", "e"], names(qs[-2:]))
+        self.assertEqual("e", qs[-1].first_name)
+        self.assertEqual(["a", "c", "e"], names(qs[::2]))
+        self.assertEqual(['2', '4'],
+                         [p.id for p in Person.objects.all()[1:4:2]])
+
+        # a collection already looked up is sliced without sorting again
+        names(qs)
+        self.assertTrue(hasattr(qs, '_cached_set'))
+        self.assertEqual(["b", "c"], names(qs[1:3]))
+        self.assertEqual(["e"], names(qs[4:]))
+
     def test_first(self):
         Person.objects.create(first_name="Granny", last_name="Goose")
         Person.objects.create(first_name="Clark", last_name="Kent")
@@ -245,6 +833,323 @@ class ModelTestCase(RediscoTestCase):
         lana = Person.objects.filter(first_name="Lana").first()
         self.assertFalse(lana)
 
+    def test_first_and_last_without_sort(self):
+        from redisco.models.modelset import _tracing_client
+
+        class Event(models.Model):
+            kind = models.Attribute()
+            score = models.IntegerField()
+            name = models.Attribute()
+
+        for kind, score in (("a", 20), ("b", 10), ("a", 30), ("b", 40)):
+            Event.objects.create(kind=kind, score=score)
+
+        def traced(qs):
+            commands = []
+            qs._db = _tracing_client(qs.db, commands)
+            return qs, commands
+
+        qs, commands = traced(Event.objects.order('-score'))
+        self.assertEqual(40, qs.first().score)
+        self.assertEqual([['ZREVRANGE', 'ZCARD', 'SCARD']],
+                         [[c[0] for c in rt] for rt in commands])
+        self.assertEqual(10, qs.last().score)
+        qs, commands = traced(Event.objects.filter(kind="a"))
+        self.assertEqual('3', qs.last().id)
+        self.assertEqual('1', qs.first().id)
+        self.assertEqual([['SORT'], ['SORT']],
+                         [[c[0] for c in rt] for rt in commands])
+        self.assertEqual(None, Event.objects.filter(kind="c").last())
+        self.assertEqual('4', Event.objects.order('score', 'kind').last().id)
+        self.assertEqual('2', Event.objects.filter(kind="b").order('score')
+                                                           .first().id)
+
+        # limited collections: the first and last objects of the page
+        page = Event.objects.order('score').limit(2)
+        self.assertEqual(10, page.first().score)
+        self.assertEqual(20, page.last().score)
+        page = Event.objects.order('score').limit(2, offset=1)
+        self.assertEqual(20, page.first().score)
+        self.assertEqual(30, page.last().score)
+        self.assertEqual('2', Event.objects.all().limit(2, offset=1).first().id)
+        self.assertEqual(None, Event.objects.all().limit(2, offset=9).last())
+
+        # objects without a value come first with a score of 0
+        Event.objects.create(kind="c")
+        self.assertEqual('5', Event.objects.order('score').first().id)
+        self.assertEqual('5', Event.objects.order('-score').last().id)
+
+        self.assertEqual('2', Event.objects.earliest('score').id)
+        self.assertEqual('4', Event.objects.latest('score').id)
+        qs, commands = traced(Event.objects.filter(kind="a"))
+        self.assertEqual('1', qs.earliest('score').id)
+        self.assertEqual('3', qs.latest('score').id)
+        self.assertEqual(2, len(commands))
+        self.assertEqual(None, Event.objects.filter(kind="c").latest('score'))
+        self.assertRaises(models.exceptions.AttributeNotIndexed,
+                          Event.objects.latest, 'name')
+
+    def test_sample(self):
+        for i in range(10):
+            Person.objects.create(first_name="Granny" if i % 2 else "Clark",
+                                  last_name="Kent%d" % i)
+
+        grannies = Person.objects.filter(first_name="Granny")
+        sample = grannies.sample(3)
+        self.assertEqual(3, len(sample))
+        self.assertEqual(3, len(set(sample)))
+        for p in sample:
+            self.assertEqual("Granny", p.first_name)
+        self.assertFalse(hasattr(grannies, '_cached_set'))
+        self.assertEqual(set(grannies), set(grannies.sample(20)))
+        self.assertEqual([], grannies.sample(0))
+        self.assertEqual([], Person.objects.filter(first_name="Lana")
+                                           .sample(2))
+        self.assertEqual(2, len(Person.objects.exclude(first_name="Clark")
+                                              .sample(2)))
+        self.assertRaises(ValueError, grannies.limit(2).sample, 1)
+
+    def test_set_operations(self):
+        class Item(models.Model):
+            name = models.Attribute(fulltext=True)
+            color = models.Attribute()
+            size = models.IntegerField()
+
+        for name, color, size in (("red box", "red", 1),
+                                  ("blue box", "blue", 2),
+                                  ("red ball", "red", 3),
+                                  ("green ball", "green", 4)):
+            Item.objects.create(name=name, color=color, size=size)
+
+        def ids(qs):
+            return sorted(i.id for i in qs)
+
+        red = Item.objects.filter(color="red")
+        blue = Item.objects.filter(color="blue")
+        balls = Item.objects.search("ball")
+        big = Item.objects.zfilter(size__gte=3)
+
+        self.assertEqual(['1', '2', '3'], ids(red | blue))
+        self.assertEqual(['3'], ids(red & balls))
+        self.assertEqual(['1'], ids(red - big))
+        self.assertEqual(['4'], ids(big - red))
+        self.assertEqual(['2', '4'], ids(Item.objects.all() - red))
+        self.assertEqual(['1', '2', '3', '4'], ids(red | blue | balls))
+        self.assertEqual(['3'], ids((red | blue).filter(name="red ball")))
+        self.assertEqual(['3', '1'],
+                         [i.id for i in (red | blue).exclude(color="blue")
+                                                    .order('-size')])
+        self.assertEqual(['3', '2'],
+                         [i.id for i in (big.order('-size') | blue)[1:]])
+        self.assertEqual(2, (balls - blue).count())
+        # two zfilters on the same field store their ids apart
+        self.assertEqual(['1', '2'],
+                         ids(Item.objects.zfilter(size__gt=0) -
+                             Item.objects.zfilter(size__gt=2)))
+        self.assertTrue(Item.objects.get_by_id('4') in (big & balls))
+        self.assertFalse(Item.objects.get_by_id('1') in (big | blue))
+
+        # collections using only filter and exclude are merged into Q
+        # objects and looked up in one go
+        plan = (red | blue.exclude(size=2)).explain()
+        self.assertEqual(['all', 'q', 'order'],
+                         [step['step'] for step in plan['steps']])
+        self.assertEqual(1, plan['steps'][1]['round_trips'])
+        plan = (red | big).explain()
+        self.assertEqual(['all', 'combine', 'order'],
+                         [step['step'] for step in plan['steps']])
+        self.assertEqual(2, plan['steps'][1]['round_trips'])
+
+        # in-place operators do not touch the set of all the objects
+        qs = Item.objects.all()
+        qs |= red
+        qs &= blue
+        qs -= red
+        self.assertEqual(['2'], ids(qs))
+        self.assertEqual(4, len(Item.objects.all()))
+
+        self.assertRaises(TypeError, red.__or__, Person.objects.all())
+        self.assertRaises(ValueError, red.__and__, blue.limit(1))
+
+    def test_materialized_views(self):
+        from redisco.models.modelset import _tracing_client
+
+        class Post(models.Model):
+            status = models.Attribute()
+            lang = models.Attribute()
+            score = models.IntegerField()
+
+            class Meta:
+                views = {'ranking': ({'status': 'active'}, '-score'),
+                         'drafts': {'status': 'draft'}}
+
+        for status, lang, score in (("active", "en", 5), ("active", "fr", 9),
+                                    ("draft", "en", 7), ("active", "en", 1),
+                                    ("active", "en", None)):
+            Post.objects.create(status=status, lang=lang, score=score)
+
+        def ids(qs):
+            return [p.id for p in qs]
+
+        ranking = Post.objects.view('ranking')
+        commands = []
+        ranking._db = _tracing_client(ranking.db, commands)
+        self.assertEqual(['2', '1'], ids(ranking[:2]))
+        # a single ZREVRANGE, then the objects are loaded
+        self.assertEqual([('ZREVRANGE', 'Post:_view:ranking:sorted', 0, 1)],
+                         commands[0])
+        self.assertEqual(2, len(commands))
+        self.assertEqual(['1', '4'], ids(ranking[1:]))
+        self.assertEqual(['2', '1', '4'], ids(ranking))
+        self.assertEqual(['4', '1', '2'], ids(Post.objects.view('ranking')
+                                                          .order('score')))
+        self.assertEqual('2', Post.objects.view('ranking').first().id)
+        self.assertEqual(['3'], ids(Post.objects.view('drafts')))
+        self.assertEqual(['1', '4'], ids(ranking.filter(lang="en")))
+        self.assertEqual(3, ranking.count())
+        self.assertTrue(Post.objects.get_by_id('4') in ranking)
+        self.assertFalse(Post.objects.get_by_id('3') in ranking)
+        # combined collections are restricted to the view
+        combined = (Post.objects.filter(lang="fr") |
+                    Post.objects.zfilter(score__gt=6))
+        self.assertEqual(['2', '3'], sorted(ids(combined)))
+        self.assertEqual(['2'], ids(combined.view('ranking')))
+        self.assertEqual(['3'], ids(combined.view('drafts')))
+
+        # the views follow the changes of the objects
+        def top():
+            return ids(Post.objects.view('ranking')[:10])
+
+        p = Post.objects.get_by_id('3')
+        p.status = "active"
+        p.save()
+        self.assertEqual(['2', '3', '1', '4'], top())
+        self.assertEqual([], ids(Post.objects.view('drafts')))
+        Post.objects.get_by_id('2').delete()
+        self.assertEqual(['3', '1', '4'], top())
+        self.assertEqual(4, Post.objects.filter(lang="en").update(score=2))
+        self.assertEqual(['1', '3', '4', '5'], sorted(top()))
+        self.assertEqual(4, Post.objects.view('ranking').filter(lang="en")
+                                        .update(status="draft"))
+        self.assertEqual(['1', '3', '4', '5'],
+                         sorted(ids(Post.objects.view('drafts'))))
+        self.assertEqual([], top())
+        Post.objects.all().delete()
+        self.assertEqual([], [k for k in self.client.keys('Post:_view:*')
+                              if '#' not in k])
+
+        self.assertRaises(ValueError, Post.objects.view, 'unknown')
+
+        def declare():
+            class Bad(models.Model):
+                name = models.Attribute()
+
+                class Meta:
+                    views = {'by_name': ({}, 'name')}
+        self.assertRaises(ValueError, declare)
+
+        def misspelled():
+            class Bad(models.Model):
+                name = models.Attribute()
+
+                class Meta:
+                    views = {'named': {'nmae': "a"}}
+        self.assertRaises(ValueError, misspelled)
+
+        # a list matches when it holds the value
+        class Car(models.Model):
+            colors = models.ListField(str)
+            status = models.Attribute()
+
+            class Meta:
+                views = {'red': {'colors': "Red"}}
+
+        Car.objects.create(colors=["Red", "Blue"], status="new")
+        Car.objects.create(colors=["Blue"], status="new")
+        Car.objects.create(status="new")
+        self.assertEqual(['1'], ids(Car.objects.view('red')))
+        car = Car.objects.get_by_id('2')
+        car.colors = ["Red"]
+        car.save()
+        self.assertEqual(['1', '2'], ids(Car.objects.view('red')))
+        self.assertEqual(3, Car.objects.all().update(status="old"))
+        self.assertEqual(['1', '2'], ids(Car.objects.view('red')
+                                         .filter(status="old")))
+        Car.objects.get_by_id('1').delete()
+        self.assertEqual(['2'], ids(Car.objects.view('red')))
+
+    def test_partitioned_datetime_index(self):
+        from datetime import datetime
+        from dateutil.tz import tzutc
+
+        class Event(models.Model):
+            name = models.Attribute()
+            at = models.DateTimeField(partition='day')
+
+        def utc(day, hour=0):
+            return datetime(2012, 3, day, hour, tzinfo=tzutc())
+
+        for name, day, hour in (("a", 1, 10), ("b", 1, 23), ("c", 2, 0),
+                                ("d", 3, 12), ("e", 5, 8)):
+            Event.objects.create(name=name, at=utc(day, hour))
+
+        def names(qs):
+            return sorted(e.name for e in qs)
+
+        self.assertEqual(['2012-03-01', '2012-03-02', '2012-03-03',
+                          '2012-03-05'],
+                         self.client.zrange('Event:at:_partitions', 0, -1))
+        self.assertEqual(2, self.client.zcard('Event:at:_p:2012-03-01'))
+        self.assertFalse(self.client.exists('Event:at'))
+
+        self.assertEqual(['b', 'c', 'd'],
+                         names(Event.objects.zfilter(at__in=(utc(1, 12),
+                                                             utc(3, 12)))))
+        self.assertEqual(['d', 'e'],
+                         names(Event.objects.zfilter(at__gt=utc(2))))
+        self.assertEqual(['a', 'b'],
+                         names(Event.objects.zfilter(at__lt=utc(2))))
+        self.assertEqual([], names(Event.objects.zfilter(at__gt=utc(6))))
+        self.assertEqual(['b'], names(Event.objects.filter(name="b")
+                                                   .zfilter(at__lt=utc(2))))
+        self.assertEqual('a', Event.objects.earliest('at').name)
+        self.assertEqual('e', Event.objects.latest('at').name)
+        self.assertEqual('c', Event.objects.filter(name="c").latest('at').name)
+        recent = Event.objects.zfilter(at__gte=utc(2))
+        self.assertTrue(Event.objects.filter(name="d").first() in recent)
+        self.assertFalse(Event.objects.filter(name="a").first() in recent)
+        self.assertEqual(['e', 'd', 'c', 'b', 'a'],
+                         [e.name for e in Event.objects.order('-at')])
+
+        # a new date moves the object to its partition
+        e = Event.objects.filter(name="a").first()
+        e.at = utc(3, 1)
+        e.save()
+        self.assertEqual(['b'], names(Event.objects.zfilter(at__lt=utc(2))))
+        self.assertEqual(1, self.client.zcard('Event:at:_p:2012-03-01'))
+        self.assertEqual(['a', 'd'],
+                         names(Event.objects.zfilter(at__in=(utc(3),
+                                                             utc(4)))))
+
+        # dropping the old partitions deletes their objects
+        self.assertRaises(ValueError, Event.objects.filter(name="b")
+                                                   .drop_partitions,
+                          'at', utc(3))
+        self.assertRaises(ValueError, Event.objects.drop_partitions,
+                          'name', utc(3))
+        self.assertEqual(2, Event.objects.drop_partitions('at', utc(3, 6)))
+        self.assertEqual(['a', 'd', 'e'], names(Event.objects.all()))
+        self.assertEqual(['2012-03-03', '2012-03-05'],
+                         self.client.zrange('Event:at:_partitions', 0, -1))
+        self.assertFalse(self.client.exists('Event:at:_p:2012-03-01'))
+        self.assertEqual([], [k for k in self.client.keys('~*drop*')])
+        self.assertEqual(None, Event.objects.filter(name="b").first())
+
+        def declare():
+            class Bad(models.Model):
+                at = models.DateTimeField(partition='week')
+        self.assertRaises(ValueError, declare)
+
 
     def test_iter(self):
         Person.objects.create(first_name="Granny", last_name="Goose")
@@ -256,6 +1161,48 @@ class ModelTestCase(RediscoTestCase):
             self.assertTrue(person.full_name() in ("Granny Goose",
                 "Clark Kent", "Granny Mommy", "Granny Kent",))
 
+    def test_iterator(self):
+        for i in range(7):
+            Person.objects.create(first_name="Granny" if i % 2 else "Clark",
+                                  last_name="Kent%d" % i)
+
+        persons = Person.objects.all()
+        iterated = set(persons.iterator(chunk_size=2))
+        self.assertFalse(hasattr(persons, '_cached_set'))
+        self.assertEqual(set(persons), iterated)
+
+        grannies = Person.objects.filter(first_name="Granny")
+        self.assertEqual(['2', '4', '6'],
+                sorted(p.id for p in grannies.iterator(chunk_size=2)))
+
+        ordered = Person.objects.order('-last_name').limit(5, 1)
+        self.assertEqual(['Kent5', 'Kent4', 'Kent3', 'Kent2', 'Kent1'],
+                [p.last_name for p in ordered.iterator(chunk_size=2)])
+        self.assertEqual([], list(Person.objects.filter(first_name="Lana")
+                                                .iterator()))
+
+    def test_unordered(self):
+        Person.objects.create(first_name="Granny", last_name="Goose")
+        clark = Person.objects.create(first_name="Clark", last_name="Kent")
+        Person.objects.create(first_name="Granny", last_name="Mommy")
+        Person.objects.create(first_name="Granny", last_name="Kent")
+
+        grannies = Person.objects.filter(first_name="Granny").unordered()
+        self.assertEqual(3, len(grannies))
+        self.assertEqual(set(['1', '3', '4']), set(p.id for p in grannies))
+        self.assertFalse(self.client.keys('*#*'))
+
+        self.assertEqual(4, Person.objects.all().count())
+        self.assertEqual(3, grannies.count())
+        self.assertEqual(2, grannies.limit(2).count())
+        self.assertEqual(1, grannies.limit(2, offset=2).count())
+        self.assertTrue(grannies.exists())
+        self.assertFalse(Person.objects.filter(first_name="Lana").exists())
+
+        self.assertTrue(clark in Person.objects.filter(last_name="Kent"))
+        self.assertFalse(clark in grannies)
+        self.assertFalse(self.client.keys('*#*'))
+
     def test_sort(self):
         Person.objects.create(first_name="Zeddicus", last_name="Zorander")
         Person.objects.create(first_name="Richard", last_name="Cypher")
@@ -274,6 +1221,35 @@ class ModelTestCase(RediscoTestCase):
         self.assertEqual("Richard Cypher", res[2].full_name())
         self.assertEqual("Kahlan Amnell", res[3].full_name())
 
+    def test_sort_on_multiple_fields(self):
+        class Exam(models.Model):
+            name = models.CharField()
+            score = models.IntegerField()
+
+        Exam.objects.create(name="Richard", score=75)
+        Exam.objects.create(name="Kahlan", score=99)
+        Exam.objects.create(name="Zeddicus", score=75)
+        Exam.objects.create(name="Cara", score=75)
+        Exam.objects.create(name="Nicci", score=9)
+
+        def names(qs):
+            return [exam.name for exam in qs]
+
+        self.assertEqual(["Kahlan", "Cara", "Richard", "Zeddicus", "Nicci"],
+                names(Exam.objects.order('-score', 'name')))
+        self.assertEqual(["Nicci", "Zeddicus", "Richard", "Cara", "Kahlan"],
+                names(Exam.objects.order('score').order('-name')))
+        self.assertEqual(["Richard", "Zeddicus"],
+                names(Exam.objects.order('-score', 'name').limit(2, 2)))
+        self.assertEqual([], names(Exam.objects.order('-score', 'name')
+                                               .limit(2, 10)))
+
+        ordered = Exam.objects.order('name')
+        self.assertEqual("Cara", ordered.order('-score').first().name)
+        # chaining does not change the original collection
+        self.assertEqual("Cara", ordered.first().name)
+        self.assertEqual([('name', True)], ordered._ordering)
+
     def test_all(self):
         person1 = Person(first_name="Granny", last_name="Goose")
         person1.save()
@@ -338,6 +1314,116 @@ class ModelTestCase(RediscoTestCase):
         filtered = Exam.objects.zfilter(score__in=(10, 96))
         self.assertEqual(3, len(filtered))
 
+    def test_sort_by_zindex(self):
+        class Exam(models.Model):
+            score = models.IntegerField()
+            average = models.FloatField()
+            passed = models.BooleanField()
+
+        for score in (9, 99, 75, -33, 95):
+            Exam.objects.create(score=score, average=score / 10.0,
+                                passed=score > 50)
+        Exam.objects.create(passed=True)
+
+        def scores(qs):
+            return [exam.score for exam in qs]
+
+        self.assertEqual([-33, None, 9, 75, 95, 99],
+                scores(Exam.objects.order('score')))
+        self.assertEqual([99, 95, 75, 9, None, -33],
+                scores(Exam.objects.order('-average')))
+        self.assertEqual([95, 75],
+                scores(Exam.objects.order('-score').limit(2, 1)))
+        self.assertEqual([None, 75, 95],
+                scores(Exam.objects.filter(passed=True)
+                                   .order('score').limit(3)))
+        self.assertEqual([75, 95],
+                scores(Exam.objects.zfilter(score__gt=10)
+                                   .order('score').limit(2)))
+
+        # every object has a value: the page is read from the index
+        from redisco.models.modelset import _tracing_client
+        for exam in Exam.objects.all():
+            if exam.score is None:
+                exam.delete()
+        qs = Exam.objects.order('-score').limit(2, 1)
+        commands = []
+        qs._db = _tracing_client(qs.db, commands)
+        self.assertEqual([95, 75], scores(qs))
+        self.assertEqual(['ZCARD', 'SCARD', 'ZREVRANGE'],
+                         [c[0] for c in commands[0]])
+        self.assertFalse([c for rt in commands for c in rt
+                          if c[0] in ('ZINTERSTORE', 'ZUNIONSTORE')])
+        self.assertEqual([-33, 9, 75, 95, 99],
+                scores(Exam.objects.order('score')))
+
+    def test_keyset_pagination(self):
+        class Exam(models.Model):
+            score = models.IntegerField()
+            passed = models.BooleanField()
+
+        for score in (9, 99, 75, 33, 95, 75, 75, 12):
+            Exam.objects.create(score=score, passed=score > 50)
+        Exam.objects.create(passed=True)
+
+        def walk(qs, step, backward=False):
+            pages, cursor = [], None
+            while True:
+                if backward:
+                    page, cursor = qs.before(cursor, step)
+                else:
+                    page, cursor = qs.after(cursor, step)
+                if not page:
+                    return pages
+                pages.append([(e.score, int(e.id)) for e in page])
+
+        ordered = Exam.objects.order('score')
+        self.assertEqual([[(9, 1), (12, 8)], [(33, 4), (75, 3)],
+                          [(75, 6), (75, 7)], [(95, 5), (99, 2)]],
+                         walk(ordered, 2))
+        self.assertEqual([[(95, 5), (99, 2)], [(75, 6), (75, 7)],
+                          [(33, 4), (75, 3)], [(9, 1), (12, 8)]],
+                         walk(ordered, 2, backward=True))
+        self.assertEqual([[(99, 2), (95, 5), (75, 7)], [(75, 6), (75, 3)]],
+                         walk(Exam.objects.filter(passed=True)
+                                          .order('-score'), 3))
+
+        # the cursor stays valid when its object is gone
+        page, cursor = ordered.after(None, 4)
+        page[-1].delete()
+        page, cursor = ordered.after(cursor, 2)
+        self.assertEqual(['6', '7'], [e.id for e in page])
+
+        self.assertRaises(ValueError, Exam.objects.all().after, None, 2)
+
+    def test_zfilter(self):
+        class Exam(models.Model):
+            score = models.IntegerField()
+            passed = models.BooleanField()
+
+        for score in (9, 99, 75, 33, 95):
+            Exam.objects.create(score=score, passed=score > 50)
+
+        def scores(qs):
+            return sorted([exam.score for exam in qs])
+
+        self.assertEqual([9, 33], scores(Exam.objects.zfilter(score__lt=75)))
+        self.assertEqual([9, 33, 75],
+                scores(Exam.objects.zfilter(score__lte=75)))
+        self.assertEqual([95, 99], scores(Exam.objects.zfilter(score__gt=75)))
+        self.assertEqual([75, 95, 99],
+                scores(Exam.objects.zfilter(score__gte=75)))
+        self.assertEqual([75, 95],
+                scores(Exam.objects.zfilter(score__in=(75, 95))))
+        self.assertEqual([75],
+                scores(Exam.objects.filter(passed=True)
+                                   .zfilter(score__lt=95)))
+        # the limit only applies to the final result
+        res = Exam.objects.zfilter(score__gt=10).order('score').limit(2, 1)
+        self.assertEqual([75, 95], [exam.score for exam in res])
+        self.assertRaises(ValueError,
+                lambda: len(Exam.objects.zfilter(score__foo=1)))
+
 
     def test_filter_date(self):
         from datetime import datetime
@@ -487,6 +1573,65 @@ class ModelTestCase(RediscoTestCase):
         student = Student()
         self.assertTrue(student.is_valid())
 
+    def test_unique_values_hash(self):
+        class Account(models.Model):
+            email = models.Attribute(unique=True)
+            login = models.Attribute(unique=True, indexed=False)
+
+        a = Account.objects.create(email="a@x", login="a")
+        self.assertEqual({'a@x': a.id}, self.client.hgetall('Account:_unique:email'))
+        self.assertEqual({'a': a.id}, self.client.hgetall('Account:_unique:login'))
+        self.assertEqual([], self.client.keys('~*'))
+
+        # nothing is claimed when one of the values is taken
+        b = Account(email="b@x", login="a")
+        self.assertFalse(b.save())
+        self.assertEqual([('login', 'not unique')], b.errors)
+        self.assertEqual(['a@x'], self.client.hkeys('Account:_unique:email'))
+
+        # changing a value releases the previous one
+        a.email = "c@x"
+        self.assertTrue(a.save())
+        self.assertTrue(Account.objects.create(email="a@x", login="b"))
+        self.assertEqual(['1', '2'], sorted(self.client.hvals('Account:_unique:email')))
+
+        a.delete()
+        self.assertEqual({'a@x': '2'}, self.client.hgetall('Account:_unique:email'))
+        self.assertEqual({'b': '2'}, self.client.hgetall('Account:_unique:login'))
+        Account.objects.all().delete()
+        self.assertEqual([], self.client.keys('Account:_unique:*'))
+
+        # objects saved before the hash was maintained are found
+        # through the index of the value
+        legacy = Account.objects.create(email="d@x")
+        self.client.delete('Account:_unique:email')
+        self.assertFalse(Account(email="d@x").is_valid())
+        self.assertTrue(legacy.is_valid())
+
+        # a single one of concurrent saves gets the value
+        results = []
+
+        def save():
+            results.append(Account(email="e@x").save())
+
+        threads = [Thread(target=save) for i in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(1, results.count(True))
+        self.assertEqual(1, len(Account.objects.filter(email="e@x")))
+
+        objs = Account.objects.bulk_get_or_create([
+            {'email': "f@x", 'login': "f"},
+            {'email': "g@x", 'login': "f"},
+            {'email': "e@x"}])
+        self.assertEqual("f@x", objs[0].email)
+        self.assertEqual(None, objs[1])
+        self.assertEqual(Account.objects.filter(email="e@x").first(), objs[2])
+        self.assertEqual(Account.objects.filter(email="f@x").first().id,
+                         self.client.hget('Account:_unique:login', 'f'))
+
     def test_long_integers(self):
         class Tweet(models.Model):
             status_id = models.IntegerField()
@@ -544,6 +1689,60 @@ class ModelTestCase(RediscoTestCase):
                 last_name="Weiss")
         self.assertEqual('7', p.id)
 
+    def test_bulk_get_or_create(self):
+        class Tag(models.Model):
+            name = models.Attribute(required=True)
+            group = models.Attribute()
+            hits = models.IntegerField(indexed=False)
+
+        a = Tag.objects.create(name="a", group="x")
+        objs = Tag.objects.bulk_get_or_create([
+            {'name': "a", 'group': "x", 'hits': 3},
+            {'name': "b", 'group': "x"},
+            {'name': "a", 'group': "y"},
+            {'name': "b", 'group': "x"},
+            {'group': "x"},
+            {'name': None, 'group': "z"}])
+        self.assertEqual(a, objs[0])
+        self.assertEqual(None, objs[0].hits)
+        self.assertEqual(objs[1], objs[3])
+        self.assertEqual(['2', '3'], [objs[1].id, objs[2].id])
+        self.assertEqual(a, objs[4])
+        self.assertEqual(None, objs[5])
+        self.assertEqual(3, len(Tag.objects.all()))
+        self.assertEqual(['x'], [t.group for t in
+                                 Tag.objects.filter(name="b")])
+
+        # deleted objects are recreated, and nothing is left behind
+        objs[1].delete()
+        b = Tag.objects.get_or_create(name="b", group="x")
+        self.assertEqual('4', b.id)
+        self.assertEqual(b, Tag.objects.get_or_create(name="b", group="x"))
+        Tag.objects.all().delete()
+        self.assertEqual([], [k for k in self.client.keys('Tag:*')
+                              if not k.endswith(':id') and '#' not in k])
+
+        # the new objects get their ids in the order of the list
+        class Code(models.Model):
+            code = models.Attribute()
+
+        objs = Code.objects.bulk_get_or_create([{'code': c} for c in "azbycx"])
+        self.assertEqual([str(i) for i in range(1, 7)], [o.id for o in objs])
+
+        # concurrent callers get the same object
+        results = []
+
+        def get_or_create():
+            results.append(Tag.objects.get_or_create(name="c").id)
+
+        threads = [Thread(target=get_or_create) for i in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(1, len(set(results)))
+        self.assertEqual(1, len(Tag.objects.filter(name="c")))
+
 
     def test_customizable_key(self):
         class Person(models.Model):
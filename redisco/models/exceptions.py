@@ -1,7 +1,7 @@
 ##########
 # ERRORS #
 ##########
-from redis import WatchError
+from redis import WatchError, ResponseError
 
 class Error(Exception):
     pass
@@ -30,19 +30,44 @@ class Manager(object):
     def get_or_create(self, **kwargs):
         return self.get_model_set().get_or_create(**kwargs)
 
-    def filter(self, **kwargs):
-        return self.get_model_set().filter(**kwargs)
+    def bulk_get_or_create(self, list_of_kwargs):
+        return self.get_model_set().bulk_get_or_create(list_of_kwargs)
 
-    def exclude(self, **kwargs):
-        return self.get_model_set().exclude(**kwargs)
+    def filter(self, *args, **kwargs):
+        return self.get_model_set().filter(*args, **kwargs)
+
+    def exclude(self, *args, **kwargs):
+        return self.get_model_set().exclude(*args, **kwargs)
 
     def get_by_id(self, id):
         return self.get_model_set().get_by_id(id)
 
-    def order(self, field):
-        return self.get_model_set().order(field)
+    def order(self, *fields):
+        return self.get_model_set().order(*fields)
 
     def zfilter(self, **kwargs):
         return self.get_model_set().zfilter(**kwargs)
 
+    def search(self, text, fields=None, rank=False):
+        return self.get_model_set().search(text, fields=fields, rank=rank)
+
+    def aggregate(self, **aggregates):
+        return self.get_model_set().aggregate(**aggregates)
+
+    def facet(self, att):
+        return self.get_model_set().facet(att)
+
+    def earliest(self, field):
+        return self.get_model_set().earliest(field)
+
+    def latest(self, field):
+        return self.get_model_set().latest(field)
+
+    def sample(self, k):
+        return self.get_model_set().sample(k)
+
+    def view(self, name):
+        return self.get_model_set().view(name)
 
+    def drop_partitions(self, field, before):
+        return self.get_model_set().drop_partitions(field, before)
@@ -1,11 +1,16 @@
 """
 Handles the queries.
 """
+import copy
+import time
 from .attributes import IntegerField, DateTimeField
 import redisco
-from redisco.containers import SortedSet, Set, List, NonPersistentList
-from .exceptions import AttributeNotIndexed
-from .attributes import ZINDEXABLE
+from redisco.containers import Set, List, NonPersistentList
+from .exceptions import AttributeNotIndexed, WatchError, ResponseError
+from .attributes import ZINDEXABLE, Counter
+from .query import Q
+from .scripts import run_script, ZRANGESTORE, MULTISORT, KEYSET, LEXSTORE, \
+        ZSUM, FACET, HMGETS, DELETE
 
 # Model Set
 class ModelSet(Set):
@@ -18,9 +23,15 @@ class ModelSet(Set):
         self._filters = {}
         self._exclusions = {}
         self._zfilters = []
+        self._qfilters = []
         self._ordering = []
         self._limit = None
         self._offset = None
+        self._unordered = False
+        self._search = None
+        self._combination = None
+        self._view = None
+        self._view_ordering = False
 
     #################
     # MAGIC METHODS #
@@ -29,21 +40,60 @@ class ModelSet(Set):
     def __getitem__(self, index):
         """
         Will look in _set to get the id and simply return the instance of the model.
+
+        Unless the collection has already been looked up, the bounds
+        are pushed down as a limit: only the requested ids are sorted
+        and stored. Negative bounds and steps need the whole collection.
         """
-        if isinstance(index, slice):
-            return map(lambda id: self._get_item_with_id(id), self._set[index])
-        else:
+        if isinstance(index, (int, long)) and index >= 0:
+            items = self[index:index + 1]
+            if not items:
+                raise IndexError
+            return items[0]
+        elif not isinstance(index, slice):
             id = self._set[index]
             if id:
                 return self._get_item_with_id(id)
             else:
                 raise IndexError
+        bounds = self._slice_bounds(index)
+        if bounds is None:
+            if isinstance(self._set, List):
+                ids = self._set.lrange(0, -1)
+            else:
+                ids = list(self._set)
+            return self._get_items_with_ids(ids[index])
+        start, stop = bounds
+        if stop is not None and stop <= start:
+            return []
+        if not hasattr(self, '_cached_set'):
+            offset = self._offset or 0
+            if self._limit is not None:
+                stop = self._limit if stop is None else min(stop, self._limit)
+            # SORT reads everything after the offset for a negative count
+            num = -1 if stop is None else max(stop - start, 0)
+            view = self._view_range()
+            if view is not None and num != 0:
+                zkey, desc = view
+                first = offset + start
+                last = -1 if num < 0 else first + num - 1
+                if desc:
+                    ids = self.db.zrevrange(zkey, first, last)
+                else:
+                    ids = self.db.zrange(zkey, first, last)
+            else:
+                ids = self.limit(num, offset + start)._set.lrange(0, -1)
+        elif isinstance(self._set, List):
+            ids = self._set.lrange(start, -1 if stop is None else stop - 1)
+        else:
+            ids = list(self._set)[index]
+        return self._get_items_with_ids(ids)
 
     def __repr__(self):
-        if len(self._set) > 30:
-            m = self._set[:30]
+        if isinstance(self._set, List):
+            m = self._set.lrange(0, 29)
         else:
-            m = self._set
+            m = list(self._set)[:30]
         s = map(lambda id: self._get_item_with_id(id), m)
         return "%s" % s
 
@@ -55,7 +105,48 @@ class ModelSet(Set):
         return len(self._set)
 
     def __contains__(self, val):
-        return val.id in self._set
+        return self._contains_id(val.id)
+
+    def __or__(self, other):
+        """
+        Return the collection of the objects of either collection.
+
+        Like the other set operations (``&`` and ``-``), nothing is
+        looked up: the result is a new collection, which can be
+        filtered further and is ordered as the left one. When both
+        collections only use ``filter`` and ``exclude``, their lookups
+        are merged into ``Q`` objects and computed in one pipeline.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     name = models.Attribute()
+        ...     size = models.IntegerField()
+        ...
+        >>> [Foo(name=n, size=s).save() for n, s in (("a", 1), ("b", 2), ("c", 3))]
+        [True, True, True]
+        >>> a, small = Foo.objects.filter(name="a"), Foo.objects.zfilter(size__lt=3)
+        >>> [f.name for f in (a | Foo.objects.filter(name="c")).order('name')]
+        [u'a', u'c']
+        >>> [f.name for f in (small - a)]
+        [u'b']
+        >>> [f.name for f in (small & Foo.objects.exclude(name="b"))]
+        [u'a']
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
+        return self._combine(other, Q.OR)
+
+    def __and__(self, other):
+        return self._combine(other, Q.AND)
+
+    def __sub__(self, other):
+        return self._combine(other, 'DIFF')
+
+    # Set would store the result into the key of the collection, which
+    # holds all the objects: the name is bound to a new collection.
+    __ior__ = __or__
+    __iand__ = __and__
+    __isub__ = __sub__
 
     ##########################################
     # METHODS THAT RETURN A SET OF INSTANCES #
@@ -80,7 +171,7 @@ class ModelSet(Set):
         >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
         [...]
         """
-        if (self._filters or self._exclusions or self._zfilters) and str(id) not in self._set:
+        if self._has_filters() and not self._contains_id(id):
             return
         if self.model_class.exists(id):
             return self._get_item_with_id(id)
@@ -104,19 +195,395 @@ class ModelSet(Set):
         >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
         [...]
         """
+        ids = self._first_ids(False)
+        if ids is not None:
+            return self._get_item_with_id(ids[0]) if ids else None
         try:
+            if self._limit is not None:
+                # the first object of the page
+                return self[0]
             return self.limit(1).__getitem__(0)
         except IndexError:
             return None
 
+    def last(self):
+        """
+        Return the last object of a collection, or None.
+
+        As with ``first``, collections ordered by id or on a single
+        numeric or date attribute are not sorted.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     name = models.Attribute()
+        ...
+        >>> [Foo(name=n).save() for n in ("a", "b", "c")]
+        [True, True, True]
+        >>> Foo.objects.exclude(name="c").last().name
+        u'b'
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
+        ids = self._first_ids(True)
+        if ids is not None:
+            return self._get_item_with_id(ids[0]) if ids else None
+        try:
+            return self._clone()[-1]
+        except IndexError:
+            return None
+
+    def earliest(self, field):
+        """
+        Return the object with the lowest value of ``field``, a numeric
+        or date attribute, or None. It is read from the sorted set index
+        of the attribute in a single command: objects without a value
+        for ``field`` are not part of the index and are never returned.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     score = models.IntegerField()
+        ...
+        >>> [Foo(score=s).save() for s in (30, 10, 20)]
+        [True, True, True]
+        >>> Foo.objects.earliest('score').score
+        10
+        >>> Foo.objects.latest('score').score
+        30
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
+        return self._extreme(field, False)
+
+    def latest(self, field):
+        """
+        Return the object with the highest value of ``field``, or None.
+        See ``earliest``.
+        """
+        return self._extreme(field, True)
+
+    def iterator(self, chunk_size=500):
+        """
+        Iterate over the objects of the collection *chunk_size* at a
+        time. Unlike iterating over the ``ModelSet`` itself, the ids are
+        not cached: only one chunk of ids and objects is in memory at
+        a time, which suits batch jobs over large collections.
+
+        Without ``order`` or ``limit``, the ids are read with SSCAN and
+        come in no particular order. An object saved or deleted while
+        iterating may or may not be returned, and SSCAN may return it
+        more than once.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     name = models.Attribute()
+        ...
+        >>> [Foo(name=n).save() for n in ("c", "a", "b")]
+        [True, True, True]
+        >>> [f.name for f in Foo.objects.order("name").iterator(2)]
+        [u'a', u'b', u'c']
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+
+        :param chunk_size: the number of objects fetched at a time.
+        """
+        for ids in self._id_chunks(chunk_size):
+            for item in self._get_items_with_ids(ids):
+                yield item
+
+    def count(self):
+        """
+        Return the number of objects in the collection. The ids are
+        counted with SCARD: they are neither sorted nor fetched.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     name = models.Attribute()
+        ...
+        >>> [Foo(name=n).save() for n in ("a", "b", "b")]
+        [True, True, True]
+        >>> Foo.objects.filter(name="b").count()
+        2
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
+        if hasattr(self, '_cached_set'):
+            return len(self._cached_set)
+        n = self._filtered_set().scard()
+        if self._limit is None:
+            return n
+        return max(0, min(self._limit, n - self._offset))
+
+    def exists(self):
+        """
+        Return True if the collection contains at least one object.
+        See ``count``.
+        """
+        return self.count() > 0
+
+    def sample(self, k):
+        """
+        Return a list of *k* objects of the collection picked at random
+        by Redis (SRANDMEMBER), or all of them, in no particular order,
+        when there are fewer. The collection is neither sorted nor
+        fetched.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     name = models.Attribute()
+        ...
+        >>> [Foo(name=n).save() for n in ("a", "b", "c")]
+        [True, True, True]
+        >>> len(Foo.objects.all().sample(2))
+        2
+        >>> [f.name for f in Foo.objects.filter(name="b").sample(2)]
+        [u'b']
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
+        if self._limit is not None:
+            raise ValueError("Cannot sample a limited collection.")
+        if k <= 0:
+            return []
+        s = self._filtered_set()
+        pipeline = self.db.pipeline()
+        pipeline.srandmember(s.key, k)
+        if self._is_temporary(s.key):
+            Set(s.key, pipeline=pipeline).set_expire()
+        ids = pipeline.execute()[0]
+        return self._get_items_with_ids(ids)
+
+    def aggregate(self, **aggregates):
+        """
+        Compute aggregates (``Sum``, ``Avg``, ``Min`` and ``Max``) of
+        numeric or date attributes over the collection, and return a
+        dict of their values by name. The sorted set index of each
+        attribute is intersected with the looked-up set: min and max
+        are then read from its ends and the sum is computed by a
+        script, so that no object is fetched.
+
+        Objects without a value for the attribute are not taken into
+        account, and an aggregate is None when none has one.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     name = models.Attribute()
+        ...     amount = models.IntegerField()
+        ...
+        >>> [Foo(name=n, amount=a).save() for n, a in (("a", 3), ("b", 5), ("b", 7))]
+        [True, True, True]
+        >>> sorted(Foo.objects.filter(name="b").aggregate(
+        ...     total=models.Sum('amount'), top=models.Max('amount')).items())
+        [('top', 7), ('total', 12)]
+        >>> Foo.objects.aggregate(avg=models.Avg('amount'))
+        {'avg': 5.0}
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
+        if self._limit is not None:
+            raise ValueError("Cannot aggregate a limited collection.")
+        for aggregate in aggregates.itervalues():
+            if not self._is_zindexed(aggregate.field):
+                raise AttributeNotIndexed(
+                        "Attribute %s has no sorted set index in %s class." %
+                        (aggregate.field, self.model_class.__name__))
+        s = self._filtered_set()
+        fields = sorted(set(a.field for a in aggregates.itervalues()))
+        pipeline = self.db.pipeline()
+        temp_keys = []
+        reads = {}
+        for field in fields:
+            needed = set(a.stat for a in aggregates.itervalues()
+                         if a.field == field)
+            key = "~%s#%s.aggregate.%s" % (s.key, field, id(self))
+            temp_keys.append(key)
+            pipeline.zinterstore(key, {s.key: 0,
+                                       self.model_class._key[field]: 1})
+            if 'min' in needed:
+                reads[field, 'min'] = len(pipeline)
+                pipeline.zrange(key, 0, 0, withscores=True)
+            if 'max' in needed:
+                reads[field, 'max'] = len(pipeline)
+                pipeline.zrevrange(key, 0, 0, withscores=True)
+            if 'sum' in needed:
+                reads[field, 'sum'] = len(pipeline)
+                run_script(self.db, ZSUM, keys=[key], client=pipeline)
+        if temp_keys:
+            pipeline.delete(*temp_keys)
+        res = pipeline.execute()
+        stats = {}
+        for field in fields:
+            stats[field] = {'min': None, 'max': None, 'sum': 0.0, 'count': 0}
+        for (field, stat), i in reads.iteritems():
+            if stat == 'sum':
+                count, total = res[i]
+                stats[field]['count'] = int(count)
+                stats[field]['sum'] = float(total)
+            elif res[i]:
+                stats[field][stat] = res[i][0][1]
+        return dict((name, a.result(self.model_class._attributes[a.field],
+                                    stats[a.field]))
+                    for name, a in aggregates.iteritems())
+
+    def facet(self, att):
+        """
+        Return the number of objects of the collection for each value
+        of the attribute ``att``, declared with ``facet``, as a dict.
+        Values that no object of the collection has are left out.
+
+        The values come from the set of the distinct values of the
+        attribute maintained with its indices; each index set is
+        intersected with the looked-up set by a script, so that only
+        the counts are sent back. The values left without any object
+        are removed from the set as they are met.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     name = models.Attribute(facet=True)
+        ...     size = models.IntegerField(facet=True)
+        ...
+        >>> [Foo(name=n, size=s).save() for n, s in (("a", 1), ("b", 1), ("b", 2))]
+        [True, True, True]
+        >>> sorted(Foo.objects.facet('name').items())
+        [(u'a', 1), (u'b', 2)]
+        >>> Foo.objects.filter(name="b").facet('size')
+        {1: 1, 2: 1}
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
+        if att not in self.model_class._facets:
+            raise AttributeNotIndexed(
+                    "Attribute %s has no facet in %s class." %
+                    (att, self.model_class.__name__))
+        if self._limit is not None:
+            raise ValueError("Cannot facet a limited collection.")
+        s = self._filtered_set()
+        key = "~%s#%s.facet.%s" % (s.key, att, id(self))
+        res = run_script(self.db, FACET,
+                         keys=[self.model_class._key['_values'][att],
+                               s.key, key],
+                         args=[self.model_class._key[att] + ':',
+                               int(s.key == self.key)])
+        desc = self.model_class._attributes.get(att)
+        facets = {}
+        for value, n in zip(res[::2], res[1::2]):
+            if desc:
+                value = desc.typecast_for_read(value)
+            else:
+                value = value.decode('utf-8')
+            facets[value] = int(n)
+        return facets
+
+    def explain(self, timings=False):
+        """
+        Run the lookup of the collection step by step and describe it:
+        for each step, the key it stores the ids in, the number of ids,
+        the commands sent (including the SORT parameters) and the number
+        of round trips to Redis. With ``timings``, the time spent in
+        each step, in seconds, is given as well.
+
+        The collection itself is left untouched, but the temporary keys
+        are created as they would be (and expire the same way).
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     name = models.Attribute()
+        ...
+        >>> [Foo(name=n).save() for n in ("a", "b", "b")]
+        [True, True, True]
+        >>> plan = Foo.objects.filter(name="b").explain()
+        >>> [(step['step'], step['size'], step['round_trips'])
+        ...  for step in plan['steps']]
+        [('all', 3, 0), ('filter', 2, 0), ('order', 2, 1)]
+        >>> plan['round_trips']
+        1
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+
+        :returns: a dict with the list of ``steps`` and the total
+            number of ``round_trips`` (and ``time``).
+        """
+        commands = []
+        clone = self._clone()
+        clone._db = _tracing_client(self.db, commands)
+        steps = []
+
+        def run(name, function, *args):
+            n, start = len(commands), time.time()
+            res = function(*args)
+            step = {'step': name,
+                    'key': res.key,
+                    'commands': [_format_command(c)
+                                 for round_trip in commands[n:]
+                                 for c in round_trip],
+                    'round_trips': len(commands) - n}
+            if timings:
+                step['time'] = time.time() - start
+            steps.append((step, res))
+            return res
+
+        s = run('all', lambda: Set(clone.key, db=clone.db))
+        for name, stage in clone._filter_stages():
+            s = run(name, stage, s)
+        run('order', clone._order, s.key)
+
+        pipeline = self.db.pipeline()
+        for step, res in steps:
+            if isinstance(res, List):
+                pipeline.llen(res.key)
+            else:
+                pipeline.scard(res.key)
+        for (step, res), size in zip(steps, pipeline.execute()):
+            step['size'] = size
+        plan = {'steps': [step for step, res in steps],
+                'round_trips': len(commands)}
+        if timings:
+            plan['time'] = sum(step['time'] for step, res in steps)
+        return plan
 
     #####################################
     # METHODS THAT MODIFY THE MODEL SET #
     #####################################
 
-    def filter(self, **kwargs):
+    def view(self, name):
         """
-        Filter a collection on criteria
+        Narrow the collection to a view declared in ``Meta``, whose
+        set (and sorted set when it is ordered) is maintained as the
+        objects are saved and deleted. A view ordered on an attribute
+        gives its order to the collection, unless ``order`` is called:
+        slicing it is then a single ZRANGE or ZREVRANGE.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     status = models.Attribute()
+        ...     score = models.IntegerField()
+        ...     class Meta:
+        ...         views = {'top': ({'status': 'active'}, '-score')}
+        ...
+        >>> [Foo(status=st, score=sc).save()
+        ...  for st, sc in (("active", 1), ("active", 3), ("closed", 5))]
+        [True, True, True]
+        >>> [f.score for f in Foo.objects.view('top')[:2]]
+        [3, 1]
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
+        views = self.model_class._materialized_views
+        if name not in views:
+            raise ValueError("%s has no view %s." %
+                             (self.model_class.__name__, name))
+        clone = self._clone()
+        clone._view = name
+        ordering = views[name][1]
+        if ordering and not clone._ordering:
+            clone = clone.order(ordering)
+            # replaced by the fields given to order
+            clone._view_ordering = True
+        return clone
+
+    def filter(self, *args, **kwargs):
+        """
+        Filter a collection on criteria. Besides keyword lookups,
+        ``Q`` objects can be given to express more complex lookups.
 
         >>> from redisco import models
         >>> class Foo(models.Model):
@@ -135,11 +602,13 @@ class ModelSet(Set):
         if not clone._filters:
             clone._filters = {}
         clone._filters.update(kwargs)
+        clone._qfilters.extend(args)
         return clone
 
-    def exclude(self, **kwargs):
+    def exclude(self, *args, **kwargs):
         """
-        Exclude a collection within a lookup.
+        Exclude a collection within a lookup. Like ``filter``, ``Q``
+        objects are accepted.
 
 
         >>> from redisco import models
@@ -160,6 +629,7 @@ class ModelSet(Set):
         if not clone._exclusions:
             clone._exclusions = {}
         clone._exclusions.update(kwargs)
+        clone._qfilters.extend([~q for q in args])
         return clone
 
     def zfilter(self, **kwargs):
@@ -169,12 +639,62 @@ class ModelSet(Set):
         clone._zfilters.append(kwargs)
         return clone
 
+    def search(self, text, fields=None, rank=False):
+        """
+        Find the objects having all the words of ``text`` in their
+        fulltext attributes (any word may be in any of them). The sets
+        of the words are intersected by Redis.
+
+        ``fields`` restricts the search to some fulltext attributes. It
+        can also be a dict giving the weight of each attribute in the
+        ranking: with ``rank=True`` and unless the collection is
+        ordered, the objects come by decreasing score, the score being
+        the weighted sum of the occurrences of the words (the number of
+        matching attributes when term frequencies are not kept).
+        Calling ``search`` again replaces the previous search.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     title = models.Attribute(fulltext=True, term_frequency=True)
+        ...
+        >>> [Foo(title=t).save() for t in ("The quick brown fox",
+        ...         "Fox, fox, fox!", "A lazy dog")]
+        [True, True, True]
+        >>> [f.title for f in Foo.objects.search("FOX quick")]
+        [u'The quick brown fox']
+        >>> [f.title for f in Foo.objects.search("fox", rank=True)]
+        [u'Fox, fox, fox!', u'The quick brown fox']
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
+        fulltext = [att for att, desc in self.model_class._attributes.iteritems()
+                    if desc.fulltext]
+        if fields is None:
+            fields = fulltext
+        if not isinstance(fields, dict):
+            fields = dict((att, 1) for att in fields)
+        if not fields:
+            raise AttributeNotIndexed(
+                    "%s class has no fulltext attribute." %
+                    self.model_class.__name__)
+        for att in fields:
+            if att not in fulltext:
+                raise AttributeNotIndexed(
+                        "Attribute %s is not fulltext indexed in %s class." %
+                        (att, self.model_class.__name__))
+        desc = self.model_class._attributes[sorted(fields)[0]]
+        clone = self._clone()
+        clone._search = (sorted(set(desc.tokenize(text))), fields, rank)
+        return clone
+
     # this should only be called once
-    def order(self, field):
+    def order(self, *fields):
         """
         Enable ordering in collections when doing a lookup.
 
-        .. Warning:: This should only be called once per lookup.
+        Several fields can be given: the following ones are only used
+        to break the ties of the previous ones. Calling ``order`` again
+        adds its fields after the ones already given.
 
         >>> from redisco import models
         >>> class Foo(models.Model):
@@ -185,24 +705,91 @@ class ModelSet(Set):
         True
         >>> Foo(name="Zztop").save()
         True
+        >>> Foo(name="Abba", exclude_me=True).save()
+        True
         >>> Foo.objects.all().order("-name").first().name
         u'Zztop'
         >>> Foo.objects.all().order("name").first().name
         u'Abba'
+        >>> Foo.objects.all().order("name", "-exclude_me").first().exclude_me
+        True
         >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
         [...]
         """
-        fname = field.lstrip('-')
-        if fname not in self.model_class._indices:
-            raise ValueError("Order parameter should be an indexed attribute.")
-        alpha = True
-        if fname in self.model_class._attributes:
-            v = self.model_class._attributes[fname]
-            alpha = not isinstance(v, ZINDEXABLE)
         clone = self._clone()
-        if not clone._ordering:
+        if clone._view_ordering:
             clone._ordering = []
-        clone._ordering.append((field, alpha,))
+            clone._view_ordering = False
+        for field in fields:
+            fname = field.lstrip('-')
+            if fname not in self.model_class._indices:
+                raise ValueError("Order parameter should be an indexed attribute.")
+            alpha = True
+            if fname in self.model_class._attributes:
+                v = self.model_class._attributes[fname]
+                alpha = not isinstance(v, ZINDEXABLE)
+            clone._ordering.append((field, alpha,))
+        return clone
+
+    def after(self, cursor, n):
+        """
+        Return the *n* objects that follow ``cursor`` and the cursor to
+        give for the next page. Use ``None`` to get the first page.
+
+        Unlike ``limit``, the cost of a page does not depend on its
+        position when the collection is not filtered: the sorted set
+        index is read from the position of the cursor. When it is
+        filtered, the index is walked from the cursor until *n* objects
+        of the collection are found, so a selective filter may read
+        most of the index for each page.
+
+        The collection should be ordered on a single numeric or date
+        attribute. Objects without a value for this attribute are not
+        part of the index and are never returned.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     score = models.IntegerField()
+        ...
+        >>> [Foo(score=s).save() for s in (30, 10, 20)]
+        [True, True, True]
+        >>> page, cursor = Foo.objects.order('score').after(None, 2)
+        >>> [f.score for f in page]
+        [10, 20]
+        >>> page, cursor = Foo.objects.order('score').after(cursor, 2)
+        >>> [f.score for f in page]
+        [30]
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+
+        :param cursor: the cursor returned by the previous page.
+        :param n: the size of the page.
+        :returns: a tuple (list of objects, cursor).
+        """
+        return self._page(cursor, n, False)
+
+    def before(self, cursor, n):
+        """
+        Return the *n* objects that precede ``cursor`` and the cursor to
+        give for the previous page. Use ``None`` to get the last page.
+        See ``after``.
+
+        :param cursor: the cursor returned by ``after`` or ``before``.
+        :param n: the size of the page.
+        :returns: a tuple (list of objects, cursor).
+        """
+        return self._page(cursor, n, True)
+
+    def unordered(self):
+        """
+        Do not sort the ids of the collection: by default, they are
+        sorted by id with SORT, which is costly for large collections.
+        The objects then come in no particular order and the collection
+        cannot be indexed or sliced.
+        This has no effect on ordered or limited collections.
+        """
+        clone = self._clone()
+        clone._unordered = True
         return clone
 
     def limit(self, n, offset=0):
@@ -256,6 +843,8 @@ class ModelSet(Set):
         >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
         [...]
         """
+        if self._lookup_for(kwargs) is not None:
+            return self._get_or_create_many([kwargs])[0]
         opts = {}
         for k, v in kwargs.iteritems():
             if k in self.model_class._indices:
@@ -266,6 +855,248 @@ class ModelSet(Set):
         else:
             return self.create(**kwargs)
 
+    def bulk_get_or_create(self, list_of_kwargs):
+        """
+        Same as calling ``get_or_create`` with each element of
+        ``list_of_kwargs``, in a few round trips whatever their number.
+        Returns the list of objects, with None for the objects that
+        could not be created because they are not valid.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     name = models.Attribute()
+        ...
+        >>> a = Foo.objects.create(name="a")
+        >>> objs = Foo.objects.bulk_get_or_create(
+        ...     [{'name': "a"}, {'name': "b"}, {'name': "b"}])
+        >>> objs[0] == a, objs[1] == objs[2], Foo.objects.all().count()
+        (True, True, 2)
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
+        lean = [kwargs for kwargs in list_of_kwargs
+                if self._lookup_for(kwargs) is not None]
+        objects = dict(zip(map(id, lean), self._get_or_create_many(lean)))
+        return [objects[id(kwargs)] if id(kwargs) in objects
+                else self.get_or_create(**kwargs)
+                for kwargs in list_of_kwargs]
+
+    def update(self, **fields):
+        """
+        Set the given attributes of every object of the collection to
+        the same values and return the number of objects updated.
+
+        The objects are not loaded: for each chunk of ids, the current
+        values of the indexed attributes are read by a script, then the
+        objects are moved from the old index entries to the new ones
+        and their hashes are updated in one transaction. The chunk is
+        retried if one of the objects is changed in the meantime, and
+        waits while one of them is locked by a save.
+
+        Like a save, the attributes are validated, but neither the
+        ``validate`` method of the model nor the ``auto_now`` dates are
+        applied. Unique attributes and counters cannot be updated.
+        Models with indices computed in ``Meta`` are saved object by
+        object, as the indices may depend on any attribute.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     name = models.Attribute()
+        ...     status = models.Attribute()
+        ...
+        >>> [Foo(name=n, status="new").save() for n in ("a", "b", "c")]
+        [True, True, True]
+        >>> Foo.objects.exclude(name="b").update(status="done")
+        2
+        >>> [f.name for f in Foo.objects.filter(status="done")]
+        [u'a', u'c']
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
+        model = self.model_class
+        for att in fields:
+            desc = model._attributes.get(att)
+            if desc is None or isinstance(desc, Counter):
+                raise ValueError("Cannot update %s: only attributes can "
+                                 "be updated." % att)
+            if desc.unique:
+                raise ValueError("Cannot update %s: its values should be "
+                                 "unique." % att)
+        probe = model(**fields)
+        for att in fields:
+            model._attributes[att].validate(probe)
+
+        if [i for i in model._indices
+            if i not in model._attributes and i not in model._lists]:
+            n = 0
+            for ids in self._id_chunks(self._chunk_size, ordered=False):
+                for obj in self._get_items_with_ids(ids):
+                    obj.update_attributes(**fields)
+                    if obj.save():
+                        n += 1
+            return n
+
+        # the values needed to find the index entries to remove
+        read = set(fields)
+        for compound in model._compound_indices:
+            if read & set(compound):
+                read.update(compound)
+        for filters, ordering, atts in model._materialized_views.values():
+            if read & atts:
+                read.update(atts)
+        # the lists are read with their own keys
+        read = sorted(att for att in read if att not in model._lists and (
+                      att in model._indices or
+                      model._attributes[att].lex_indexed or
+                      model._attributes[att].fulltext or
+                      any(att in c for c in model._compound_indices) or
+                      any(att in atts for filters, ordering, atts
+                          in model._materialized_views.values())))
+        h = {}
+        removed = []
+        for att, value in fields.iteritems():
+            if value is None:
+                removed.append(att)
+            else:
+                h[att] = model._attributes[att].typecast_for_storage(value)
+
+        n = 0
+        for ids in self._id_chunks(self._chunk_size, ordered=False):
+            keys = [model._key[id] for id in ids]
+            locks = [key['_lock'] for key in keys]
+            with self.db.pipeline() as pipeline:
+                while True:
+                    try:
+                        # the set of all objects tells the objects
+                        # without a hash from the deleted ones
+                        pipeline.watch(*([model._key['all']] + keys + locks))
+                        # the pipeline sends the commands right away
+                        # until multi() is called
+                        if self._locked(pipeline.mget(locks)):
+                            # an object is being saved: its indices
+                            # may be read before our changes are made
+                            pipeline.unwatch()
+                            time.sleep(0.05)
+                            continue
+                        rows = pipeline.eval(HMGETS, len(keys) + 1,
+                                             *([model._key['all']] + keys +
+                                               [len(read)] + read + ids))
+                        pipeline.multi()
+                        updated = 0
+                        for id, row in zip(ids, rows):
+                            if row is None:
+                                continue
+                            obj = model()
+                            obj._set_id(id, dict((att, v) for att, v
+                                                 in zip(read, row)
+                                                 if v is not None))
+                            obj._delete_from_indices_of(fields, pipeline)
+                            for att, value in fields.iteritems():
+                                setattr(obj, att, value)
+                            obj._add_to_indices(pipeline, atts=fields)
+                            if h:
+                                pipeline.hmset(obj.key(), h)
+                            if removed:
+                                pipeline.hdel(obj.key(), *removed)
+                            updated += 1
+                        pipeline.execute()
+                        n += updated
+                        break
+                    except WatchError:
+                        continue
+        return n
+
+    def _locked(self, locks):
+        """
+        Whether one of the values ``locks`` of the ``_lock`` keys of
+        objects is a lock held by ``Mutex`` that has not expired.
+        """
+        now = time.time()
+        return any(lock is not None and float(lock) >= now
+                   for lock in locks)
+
+    def delete(self):
+        """
+        Delete every object of the collection and return the number of
+        objects deleted.
+
+        The objects are not loaded: a script run for each chunk of ids
+        removes them from their indices (as recorded for each object),
+        from the hashes of the unique values and from the set of all
+        the objects, and deletes their hashes, bookkeeping keys and
+        lists.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     name = models.Attribute()
+        ...
+        >>> [Foo(name=n).save() for n in ("a", "b", "c")]
+        [True, True, True]
+        >>> Foo.objects.exclude(name="b").delete()
+        2
+        >>> [f.name for f in Foo.objects.all()]
+        [u'b']
+        >>> Foo.objects.all().delete()
+        1
+        """
+        n = 0
+        for ids in self._id_chunks(self._chunk_size, ordered=False):
+            n += self._delete_ids(ids)
+        return n
+
+    def drop_partitions(self, field, before):
+        """
+        Delete the objects of the partitions of ``field``, a
+        DateTimeField declared with ``partition``, that end before the
+        datetime ``before`` and return the number of objects deleted.
+
+        Each partition is renamed away, its objects are deleted as
+        ``delete`` does and it is then freed by UNLINK, in the
+        background (DEL before Redis 4.0, which has no UNLINK). The
+        partitions dropped should not receive new objects anymore.
+
+        >>> from datetime import datetime
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     at = models.DateTimeField(partition='day')
+        ...
+        >>> [Foo(at=datetime(2010, 4, d)).save() for d in (19, 19, 20)]
+        [True, True, True]
+        >>> Foo.objects.all().drop_partitions('at', datetime(2010, 4, 21))
+        3
+        """
+        if self._has_filters() or self._limit is not None:
+            raise ValueError("Cannot drop the partitions of a filtered "
+                             "collection.")
+        if not self._is_partitioned(field):
+            raise ValueError("Attribute %s is not partitioned." % field)
+        model = self.model_class
+        desc = model._attributes[field]
+        registry = model._key[field]['_partitions']
+        end = float(desc.typecast_for_storage(before))
+        n = 0
+        for name in self.db.zrangebyscore(registry, '-inf', end):
+            if desc.partition_bounds(name)[1] > end:
+                continue
+            partition = model._key[field]['_p'][name]
+            detached = "~%s.drop.%s" % (partition, id(self))
+            if self.db.exists(partition):
+                self.db.rename(partition, detached)
+                size = self.db.zcard(detached)
+                for i in xrange(0, size, self._chunk_size):
+                    ids = self.db.zrange(detached, i,
+                                         i + self._chunk_size - 1)
+                    n += self._delete_ids(ids)
+                try:
+                    self.db.execute_command('UNLINK', detached)
+                except ResponseError:
+                    # no UNLINK before Redis 4.0
+                    self.db.delete(detached)
+            self.db.zrem(registry, name)
+        return n
+
+    _chunk_size = 500
+
     #
 
     @property
@@ -283,43 +1114,609 @@ class ModelSet(Set):
         filtered and ordered. This set is build hen we first access
         it and is cached for has long has the ModelSet exist.
         """
-        # For performance reasons, only one zfilter is allowed.
         if hasattr(self, '_cached_set'):
             return self._cached_set
-        s = Set(self.key)
-        if self._zfilters:
-            s = self._add_zfilters(s)
-        if self._filters:
-            s = self._add_set_filter(s)
-        if self._exclusions:
-            s = self._add_set_exclusions(s)
+        s = self._filtered_set()
         n = self._order(s.key)
         self._cached_set = n
         return self._cached_set
 
+    def _filtered_set(self):
+        """
+        Apply the zfilters, filters and exclusions (in that order)
+        and return the Set of the matching ids, in no particular order.
+        """
+        s = Set(self.key, db=self.db)
+        for name, stage in self._filter_stages():
+            s = stage(s)
+        return s
+
+    def _id_chunks(self, chunk_size, ordered=True):
+        """
+        Generate the ids of the collection by lists of about
+        ``chunk_size`` ids: SSCAN on the looked-up set when the order
+        does not matter, or LRANGE on the sorted list (ordered or ranked
+        by ``search``).
+
+        When ``ordered`` is False, the ordering is ignored (unless the
+        collection is limited) and the looked-up set is copied first
+        when it is the collection or an index, so that the caller can
+        change the indices as it goes.
+        """
+        s = self._filtered_set()
+        ranked = self._search and self._search[2]
+        if (not ordered or not (self._ordering or ranked)) and \
+                self._limit is None:
+            key, cursor = s.key, 0
+            if not ordered and not self._is_temporary(key):
+                key = "~%s.copy.%s" % (s.key, id(self))
+                pipeline = self.db.pipeline()
+                pipeline.sunionstore(key, [s.key])
+                Set(key, pipeline=pipeline).set_expire()
+                pipeline.execute()
+        else:
+            key, cursor = self._order(s.key).key, None
+        start = 0
+        while True:
+            pipeline = self.db.pipeline()
+            if cursor is None:
+                pipeline.lrange(key, start, start + chunk_size - 1)
+            else:
+                pipeline.sscan(key, cursor, count=chunk_size)
+            if cursor is None or self._is_temporary(key):
+                # keep the temporary key alive until the end
+                Set(key, pipeline=pipeline).set_expire()
+            res = pipeline.execute()[0]
+            if cursor is None:
+                ids = res
+            else:
+                cursor, ids = res
+            if ids:
+                yield ids
+            if (cursor is None and len(ids) < chunk_size) or cursor == 0:
+                return
+            start += chunk_size
+
+    def _contains_id(self, id):
+        """
+        Whether the object ``id`` is part of the collection. Unless the
+        collection is limited or already looked up, the lookups are
+        checked for this id only, in one pipeline: SISMEMBER on the
+        index sets of the view, filters and exclusions and ZSCORE for
+        the zfilter. Q objects, searches, set operations and lexicographic
+        lookups are answered with the looked-up set.
+        """
+        id = str(id)
+        if hasattr(self, '_cached_set') or self._limit is not None:
+            return id in self._set
+        lex = [k for k in self._filters.keys() + self._exclusions.keys()
+               if k.partition('__')[2] in self._lex_lookups]
+        if self._qfilters or self._search or self._combination or lex:
+            return id in self._filtered_set()
+        indices, filters = self._compound_filter_keys()
+        groups = [[self.key]] + [[index] for index in indices]
+        if self._view:
+            groups.append([self.model_class._key['_view'][self._view]])
+        groups.extend([self._lookup_keys(k, v)
+                       for k, v in filters.iteritems()])
+        exclusions = [self._lookup_keys(k, v)
+                      for k, v in self._exclusions.iteritems()]
+        pipeline = self.db.pipeline()
+        for group in groups + exclusions:
+            for key in group:
+                pipeline.sismember(key, id)
+        if self._zfilters:
+            k, v = self._zfilters[0].items()[0]
+            att, min, max = self._zfilter_bounds(k, v)
+            if self._is_partitioned(att):
+                pipeline.hget(self.model_class._key[id], att)
+            else:
+                pipeline.zscore(self.model_class._key[att], id)
+        res = pipeline.execute()
+        if self._zfilters:
+            score = res.pop()
+            if score is None or not _score_between(float(score), min, max):
+                return False
+        for group in groups:
+            if not any(res[:len(group)]):
+                return False
+            res = res[len(group):]
+        return not any(res)
+
+    def _has_filters(self):
+        """
+        Whether the collection is narrower than all the objects.
+        """
+        return bool(self._filters or self._exclusions or self._zfilters or
+                    self._qfilters or self._search or self._combination or
+                    self._view)
+
+    def _lookup_for(self, kwargs):
+        """
+        Return a tuple identifying the values of the indexed
+        attributes of ``kwargs`` and the keys of their indices.
+        Returns None when ``get_or_create`` cannot intersect these
+        indices: the collection is filtered or ``kwargs`` gives no
+        indexed attribute, the value of a list or of a computed index.
+        """
+        if self._has_filters():
+            return None
+        model = self.model_class
+        atts = sorted(k for k in kwargs if k in model._indices)
+        if not atts:
+            return None
+        values = []
+        for att in atts:
+            if (att not in model._attributes or att in model._lists or
+                    kwargs[att] is None):
+                return None
+            values.append(model._attributes[att].typecast_for_storage(
+                kwargs[att]))
+        return ((tuple(atts), tuple(values)),
+                [self._build_key_from_filter_item(att, kwargs[att])
+                 for att in atts])
+
+    def _get_or_create_many(self, list_of_kwargs):
+        """
+        Find or create the objects of ``list_of_kwargs``.
+
+        The indices of the values (see ``_lookup_for``) are
+        intersected, the oldest matching object being returned. They
+        are watched while the missing objects are created, in a single
+        transaction, so concurrent callers end up with the same
+        object. So are the hashes of the unique values, which are
+        claimed in the same transaction.
+        """
+        if not list_of_kwargs:
+            return []
+        model = self.model_class
+        lookups = [self._lookup_for(kwargs) for kwargs in list_of_kwargs]
+        pending, seen = [], set()
+        for lookup, kwargs in zip(lookups, list_of_kwargs):
+            if lookup[0] not in seen:
+                seen.add(lookup[0])
+                pending.append((lookup, kwargs))
+        uniques = [model._key['_unique'][att]
+                   for att, desc in model._attributes.iteritems()
+                   if desc.unique]
+        instances = {}
+        with self.db.pipeline() as pipeline:
+            while True:
+                try:
+                    ids = {}
+                    created = {}
+                    keys = set(uniques)
+                    for (ident, indices), kwargs in pending:
+                        keys.update(indices)
+                    pipeline.watch(*keys)
+                    reads = self.db.pipeline(transaction=False)
+                    for (ident, indices), kwargs in pending:
+                        reads.sinter(indices + [self.key])
+                    results = reads.execute()
+                    missing = []
+                    for matches, (lookup, kwargs) in zip(results, pending):
+                        if matches:
+                            ids[lookup[0]] = min(matches, key=int)
+                        else:
+                            missing.append((lookup, kwargs))
+                    claimed = set()
+                    for lookup, kwargs in missing:
+                        if lookup[0] not in instances:
+                            instances[lookup[0]] = model(**kwargs)
+                        instance = instances[lookup[0]]
+                        created[lookup[0]] = None
+                        if not instance.is_valid():
+                            continue
+                        # the objects of the list cannot share a value
+                        # of a unique attribute either
+                        values = set((att, getattr(instance, att))
+                                     for att in instance.attributes
+                                     if instance.attributes[att].unique and
+                                     getattr(instance, att))
+                        if values & claimed:
+                            instance._errors.extend(
+                                (att, 'not unique') for att, value
+                                in values & claimed)
+                            continue
+                        claimed.update(values)
+                        created[lookup[0]] = instance
+                    # the ids follow the order of the list
+                    fresh = [created[ident] for (ident, indices), kwargs
+                             in missing if created[ident] is not None and
+                             created[ident].is_new()]
+                    if fresh:
+                        last = self.db.incr(model._key['id'], len(fresh))
+                        for n, instance in enumerate(fresh):
+                            instance._id = str(last - len(fresh) + n + 1)
+                    pipeline.multi()
+                    for (ident, indices), kwargs in missing:
+                        instance = created[ident]
+                        if instance is not None:
+                            instance._claim_unique_values(pipeline)
+                            instance._write(True, pipeline)
+                    pipeline.execute()
+                    break
+                except WatchError:
+                    continue
+        found = sorted(set(ids.itervalues()))
+        found = dict(zip(found, self._get_items_with_ids(found)))
+        objects = []
+        for lookup in lookups:
+            if lookup[0] in created:
+                objects.append(created[lookup[0]])
+            else:
+                objects.append(found[ids[lookup[0]]])
+        return objects
+
+    def _filter_stages(self):
+        """
+        Return the stages applied by ``_filtered_set``, in order, as
+        a list of ``(name, function)``. Each function takes the Set
+        of the previous stage and returns a new one.
+        """
+        stages = []
+        if self._view:
+            stages.append(('view', self._add_view))
+        if self._combination:
+            stages.append(('combine', self._add_combination))
+        # For performance reasons, only one zfilter is allowed.
+        if self._zfilters:
+            stages.append(('zfilter', self._add_zfilters))
+        if self._filters:
+            stages.append(('filter', self._add_set_filter))
+        if self._qfilters:
+            stages.append(('q', self._add_q_filters))
+        if self._search:
+            stages.append(('search', self._add_search))
+        if self._exclusions:
+            stages.append(('exclude', self._add_set_exclusions))
+        return stages
+
     def _add_set_filter(self, s):
         """
         This function is the internal of the `filter` function.
         It simply creates a new "intersection" of indexed keys (the filter) and
         the previous filtered keys (if any).
 
-        .. Note:: This function uses the ``Set`` container class.
+        The compound indices covered by the lookups replace the
+        indices of their attributes. When a single index is left and
+        there is nothing to intersect it with, it is used as is.
 
         :return: the new Set
         """
-        indices = []
-        for k, v in self._filters.iteritems():
-            index = self._build_key_from_filter_item(k, v)
-            if k not in self.model_class._indices:
-                raise AttributeNotIndexed(
-                        "Attribute %s is not indexed in %s class." %
-                        (k, self.model_class.__name__))
-            indices.append(index)
+        pipeline = self.db.pipeline()
+        temp_keys = []
+        indices, filters = self._compound_filter_keys()
+        indices.extend([self._filter_key(k, v, pipeline, temp_keys)
+                        for k, v in filters.iteritems()])
+        if len(indices) == 1 and s.key == self.key and not temp_keys:
+            return Set(indices[0], db=self.db)
         new_set_key = "~%s.%s" % ("+".join([self.key] + indices), id(self))
-        s.intersection(new_set_key, *[Set(n, db=self.db) for n in indices])
-        new_set = Set(new_set_key, db=self.db)
-        new_set.set_expire()
-        return new_set
+        pipeline.sinterstore(new_set_key, [s.key] + indices)
+        Set(new_set_key, pipeline=pipeline).set_expire()
+        if temp_keys:
+            pipeline.delete(*temp_keys)
+        pipeline.execute()
+        return Set(new_set_key, db=self.db)
+
+    def _add_view(self, s):
+        """
+        The set of a view declared in ``Meta`` is maintained when the
+        objects are saved: it is used as is, as it always comes first.
+
+        :return: the Set of the view
+        """
+        return Set(self.model_class._key['_view'][self._view], db=self.db)
+
+    def _view_range(self):
+        """
+        Return the sorted set of the view and whether it should be
+        read in descending order, when the collection can be read
+        from it directly: the view is its only lookup and it is
+        ordered on the attribute of the view. Returns None otherwise.
+        """
+        if not self._view or len(self._ordering) != 1:
+            return None
+        if (self._filters or self._exclusions or self._zfilters or
+                self._qfilters or self._search or self._combination):
+            return None
+        views = self.model_class._materialized_views
+        ordering = views[self._view][1]
+        field = self._ordering[0][0]
+        if not ordering or field.lstrip('-') != ordering.lstrip('-'):
+            return None
+        return (self.model_class._key['_view'][self._view]['sorted'],
+                field.startswith('-'))
+
+    def _set_with_view_ordering(self, skey):
+        """
+        Store the page of the collection from the sorted set of its
+        view, which is already in order.
+
+        :return: a List of `id`
+        """
+        zkey, desc = self._view_range()
+        num, start = self._get_limit_and_offset()
+        new_set_key = "%s#view.%s" % (skey, id(self))
+        pipeline = self.db.pipeline()
+        pipeline.sort(zkey, by='nosort', store=new_set_key, start=start,
+                      num=num, desc=desc)
+        List(new_set_key, pipeline=pipeline).set_expire()
+        pipeline.execute()
+        return List(new_set_key, db=self.db)
+
+    def _combine(self, other, connector):
+        """
+        Internals of the set operators. ``connector`` is ``Q.OR``,
+        ``Q.AND`` or ``'DIFF'``.
+        """
+        if (not isinstance(other, ModelSet) or
+                other.model_class is not self.model_class):
+            raise TypeError("Can only combine collections of the same "
+                            "model.")
+        if self._limit is not None or other._limit is not None:
+            raise ValueError("Cannot combine limited collections.")
+        combined = self.__class__(self.model_class)
+        combined._ordering = list(self._ordering)
+        left, right = self._as_q(), other._as_q()
+        if left is None or right is None:
+            combined._combination = (connector, self, other)
+        elif connector == Q.OR:
+            combined._qfilters = [left | right]
+        elif connector == Q.AND:
+            combined._qfilters = [left & right]
+        else:
+            combined._qfilters = [left & ~right]
+        return combined
+
+    def _as_q(self):
+        """
+        Return a ``Q`` object with the lookups of ``filter`` and
+        ``exclude``, or None when the collection has other lookups.
+        """
+        if self._zfilters or self._search or self._combination or self._view:
+            return None
+        q = Q(**self._filters)
+        for qfilter in self._qfilters:
+            q = q & qfilter
+        for k, v in self._exclusions.iteritems():
+            q = q & ~Q(**{k: v})
+        return q
+
+    def _add_combination(self, s):
+        """
+        Looks up the collections combined by a set operator which
+        cannot be merged into ``Q`` objects, and stores the result of
+        the operation, intersected with ``s`` when it is filtered.
+
+        :return: the new Set
+        """
+        connector, left, right = self._combination
+        command, symbol = self._set_operations[connector]
+        # looked up with the client of the collection, which may be
+        # traced by explain. Both clones are kept until the end: the
+        # names of their temporary keys end with their id().
+        operands = [left._clone(), right._clone()]
+        keys = []
+        for operand in operands:
+            operand._db = self._db
+            keys.append(operand._filtered_set().key)
+        new_set_key = "~(%s).%s" % (symbol.join(keys), id(self))
+        pipeline = self.db.pipeline()
+        getattr(pipeline, command)(new_set_key, keys)
+        if s.key != self.key:
+            # the previous stages (a view)
+            pipeline.sinterstore(new_set_key, [new_set_key, s.key])
+        Set(new_set_key, pipeline=pipeline).set_expire()
+        pipeline.execute()
+        return Set(new_set_key, db=self.db)
+
+    _set_operations = {Q.OR: ('sunionstore', '|'),
+                       Q.AND: ('sinterstore', '&'),
+                       'DIFF': ('sdiffstore', '-')}
+
+    def _compound_filter_keys(self):
+        """
+        Return the keys of the compound indices covered by the filters
+        and the filters left.
+        """
+        filters = dict(self._filters)
+        indices = []
+        for atts in sorted(self.model_class._compound_indices,
+                           key=len, reverse=True):
+            if all(att in filters for att in atts):
+                values = [filters.pop(att) for att in atts]
+                indices.append(self._build_key_from_compound(atts, values))
+        return indices, filters
+
+    def _add_q_filters(self, s):
+        """
+        This function is the internals of the `filter` function when it
+        is given ``Q`` objects. Every expression is compiled into set
+        operations on the indices which are all sent in one pipeline.
+
+        :return: the new Set
+        """
+        pipeline = self.db.pipeline()
+        temp_keys = []
+        intersect, substract = [], []
+        for q in self._qfilters:
+            key, negated = self._compile_q(q, pipeline, temp_keys)
+            if negated:
+                substract.append(key)
+            else:
+                intersect.append(key)
+        new_set_key = "~%s.%s" % ("+".join([self.key] + intersect +
+                                           ["-" + k for k in substract]),
+                                  id(self))
+        pipeline.sinterstore(new_set_key, [s.key] + intersect)
+        if substract:
+            pipeline.sdiffstore(new_set_key, [new_set_key] + substract)
+        Set(new_set_key, pipeline=pipeline).set_expire()
+        if temp_keys:
+            pipeline.delete(*temp_keys)
+        pipeline.execute()
+        return Set(new_set_key, db=self.db)
+
+    def _compile_q(self, q, pipeline, temp_keys):
+        """
+        Queue the set operations computing ``q`` in ``pipeline``.
+        To avoid computing complements, the result may be negated:
+        the matching ids are then the ones *not* in the returned key.
+
+        :return: a tuple (key, negated)
+        """
+        if not q.children:
+            return self.key, q.negated
+        keys, negated_keys = [], []
+        for child in q.children:
+            if isinstance(child, Q):
+                key, negated = self._compile_q(child, pipeline, temp_keys)
+            else:
+                key = self._filter_key(child[0], child[1], pipeline,
+                                       temp_keys)
+                negated = False
+            if negated:
+                negated_keys.append(key)
+            else:
+                keys.append(key)
+
+        def store(command, sources):
+            if len(sources) == 1:
+                return sources[0]
+            key = "~%s:q%d.%s" % (self.key, len(temp_keys), id(self))
+            temp_keys.append(key)
+            getattr(pipeline, command)(key, sources)
+            return key
+
+        negated = q.negated
+        if q.connector == Q.OR:
+            # a or not b == not (b and not a)
+            keys, negated_keys = negated_keys, keys
+            negated = not negated
+        if keys:
+            key = store('sinterstore', keys)
+            if negated_keys:
+                key = store('sdiffstore', [key] + negated_keys)
+        else:
+            # not a and not b == not (a or b)
+            key = store('sunionstore', negated_keys)
+            negated = not negated
+        return key, negated
+
+    def _filter_key(self, k, v, pipeline, temp_keys):
+        """
+        Return the key of the set holding the ids of the objects
+        matching the lookup ``k=v``. This is the index set of the value
+        unless the lookup is ``att__in``: the index sets of all the
+        values are then united in a temporary key by ``pipeline``.
+        The ``startswith``, ``lt``, ``lte``, ``gt`` and ``gte`` lookups
+        read the lexicographic index of the attribute into a temporary
+        key.
+        """
+        att, _, op = k.partition('__')
+        if op in self._lex_lookups:
+            return self._lex_filter_key(k, v, pipeline, temp_keys)
+        indices = self._lookup_keys(k, v)
+        if len(indices) == 1:
+            return indices[0]
+        key = "~%s:%s%d.%s" % (self.key, k, len(temp_keys), id(self))
+        temp_keys.append(key)
+        if indices:
+            pipeline.sunionstore(key, indices)
+        return key
+
+    def _lookup_keys(self, k, v):
+        """
+        Return the index sets of the lookup ``k=v`` (an equality or an
+        ``att__in`` lookup): the objects matching it are the members
+        of any of them.
+        """
+        att, _, op = k.partition('__')
+        if att not in self.model_class._indices:
+            raise AttributeNotIndexed(
+                    "Attribute %s is not indexed in %s class." %
+                    (att, self.model_class.__name__))
+        if not op:
+            return [self._build_key_from_filter_item(att, v)]
+        if op != 'in':
+            raise ValueError("Unknown lookup %s." % k)
+        return [self._build_key_from_filter_item(att, e) for e in v]
+
+    _lex_lookups = ('startswith', 'lt', 'lte', 'gt', 'gte')
+
+    def _lex_filter_key(self, k, v, pipeline, temp_keys):
+        """
+        Queue in ``pipeline`` the ZRANGEBYLEX on the lexicographic index
+        of the attribute storing the ids matching the lookup ``k=v`` in
+        a temporary key.
+
+        Members of the index are the value and the id separated by a
+        NUL character, so that ``value\0id`` sorts right after
+        ``value`` and before any longer value.
+        """
+        att, _, op = k.partition('__')
+        desc = self.model_class._attributes.get(att)
+        if desc is None or not getattr(desc, 'lex_indexed', False):
+            raise AttributeNotIndexed(
+                    "Attribute %s is not lex indexed in %s class." %
+                    (att, self.model_class.__name__))
+        v = desc.typecast_for_storage(v)
+        if isinstance(v, unicode):
+            v = v.encode('utf-8')
+        else:
+            v = str(v)
+        min, max = {
+            'startswith': ("[" + v, "[" + v + "\xff"),
+            'gte': ("[" + v, "+"),
+            'gt': ("[" + v + "\x01", "+"),
+            'lt': ("-", "(" + v),
+            'lte': ("-", "(" + v + "\x01"),
+        }[op]
+        key = "~%s:%s%d.%s" % (self.key, k, len(temp_keys), id(self))
+        temp_keys.append(key)
+        run_script(self.db, LEXSTORE,
+                   keys=[self.model_class._key['_lex'][att],
+                         self.model_class._key['all'], key],
+                   args=[min, max, redisco.default_expire_time],
+                   client=pipeline)
+        return key
+
+    def _add_search(self, s):
+        """
+        This function is the internals of the `search` function. For
+        each word, the sets of the word in every searched attribute are
+        united, then all the words are intersected with the previous
+        filtered keys, in one pipeline.
+
+        :return: the new Set
+        """
+        terms, fields, rank = self._search
+        pipeline = self.db.pipeline()
+        temp_keys = []
+        keys = []
+        for term in terms:
+            sources = [self.model_class._key['_ft'][att][term]
+                       for att in sorted(fields)]
+            if len(sources) == 1:
+                keys.append(sources[0])
+                continue
+            key = "~%s:ft%d.%s" % (self.key, len(temp_keys), id(self))
+            temp_keys.append(key)
+            pipeline.sunionstore(key, sources)
+            keys.append(key)
+        new_set_key = "~%s.%s" % ("+".join([self.key, "search"] + terms),
+                                  id(self))
+        if keys:
+            pipeline.sinterstore(new_set_key, [s.key] + keys)
+            Set(new_set_key, pipeline=pipeline).set_expire()
+        else:
+            # no word matches nothing
+            pipeline.delete(new_set_key)
+        if temp_keys:
+            pipeline.delete(*temp_keys)
+        pipeline.execute()
+        return Set(new_set_key, db=self.db)
 
     def _add_set_exclusions(self, s):
         """
@@ -327,81 +1724,109 @@ class ModelSet(Set):
         It simply creates a new "difference" of indexed keys (the filter) and
         the previous filtered keys (if any).
 
-        .. Note:: This function uses the ``Set`` container class.
-
         :return: the new Set
         """
-        indices = []
-        for k, v in self._exclusions.iteritems():
-            index = self._build_key_from_filter_item(k, v)
-            if k not in self.model_class._indices:
-                raise AttributeNotIndexed(
-                        "Attribute %s is not indexed in %s class." %
-                        (k, self.model_class.__name__))
-            indices.append(index)
+        pipeline = self.db.pipeline()
+        temp_keys = []
+        indices = [self._filter_key(k, v, pipeline, temp_keys)
+                   for k, v in self._exclusions.iteritems()]
         new_set_key = "~%s.%s" % ("-".join([self.key] + indices), id(self))
-        s.difference(new_set_key, *[Set(n, db=self.db) for n in indices])
-        new_set = Set(new_set_key, db=self.db)
-        new_set.set_expire()
-        return new_set
+        pipeline.sdiffstore(new_set_key, [s.key] + indices)
+        Set(new_set_key, pipeline=pipeline).set_expire()
+        if temp_keys:
+            pipeline.delete(*temp_keys)
+        pipeline.execute()
+        return Set(new_set_key, db=self.db)
 
     def _add_zfilters(self, s):
         """
         This function is the internals of the zfilter function.
-        It will create a SortedSet and will compare the scores to
-        the value provided.
+        The members of the sorted set index whose score matches the
+        zfilter are intersected with the previous filtered keys
+        entirely in Redis: the ids never travel to the client.
 
-        :return: a SortedSet with the ids.
+        :return: a Set with the ids.
 
         """
         k, v = self._zfilters[0].items()[0]
+        att, min, max = self._zfilter_bounds(k, v)
+        new_set_key = "~%s.%s" % ("+".join([self.key, k]), id(self))
+        if self._is_partitioned(att):
+            return self._add_partitioned_zfilter(s, att, min, max,
+                                                 new_set_key)
+        index = self.model_class._key[att]
+        run_script(self.db, ZRANGESTORE,
+                   keys=[index, s.key, new_set_key],
+                   args=[min, max, redisco.default_expire_time])
+        return Set(new_set_key, db=self.db)
+
+    def _add_partitioned_zfilter(self, s, att, min, max, new_set_key):
+        """
+        The zfilter of a partitioned attribute only reads the
+        partitions covering its range: the matching ids of each one
+        are stored apart, in a single pipeline, and united.
+
+        :return: a Set with the ids.
+        """
+        partitions = self._partitions_between(att, min, max)
+        pipeline = self.db.pipeline()
+        temp_keys = []
+        for partition in partitions:
+            key = "~%s.%s" % (partition, id(self))
+            temp_keys.append(key)
+            run_script(self.db, ZRANGESTORE, keys=[partition, s.key, key],
+                       args=[min, max, redisco.default_expire_time],
+                       client=pipeline)
+        pipeline.delete(new_set_key)
+        if temp_keys:
+            pipeline.sunionstore(new_set_key, temp_keys)
+            pipeline.delete(*temp_keys)
+        Set(new_set_key, pipeline=pipeline).set_expire()
+        pipeline.execute()
+        return Set(new_set_key, db=self.db)
+
+    def _zfilter_bounds(self, k, v):
+        """
+        Translate a zfilter lookup (``att__op``) and its value into
+        the attribute name and the min and max scores understood by
+        ZRANGEBYSCORE.
+
+        :return: a tuple ``(att, min, max)``
+        """
         try:
             att, op = k.split('__')
         except ValueError:
             raise ValueError("zfilter should have an operator.")
-        index = self.model_class._key[att]
         desc = self.model_class._attributes[att]
-        zset = SortedSet(index, db=self.db)
-        limit, offset = self._get_limit_and_offset()
-        new_set_key = "~%s.%s" % ("+".join([self.key, att, op]), id(self))
-        new_set_key_temp = "#%s.%s" % ("+".join([self.key, att, op]), id(self))
-        members = []
-        if isinstance(v, (tuple, list,)):
+        if op == 'in':
             min, max = v
-            min = float(desc.typecast_for_storage(min))
-            max = float(desc.typecast_for_storage(max))
-        else:
-            v = float(desc.typecast_for_storage(v))
+            return (att,
+                    "%f" % float(desc.typecast_for_storage(min)),
+                    "%f" % float(desc.typecast_for_storage(max)))
+        v = float(desc.typecast_for_storage(v))
         if op == 'lt':
-            members = zset.lt(v, limit, offset)
+            return (att, "-inf", "(%f" % v)
+        elif op in ('le', 'lte'):
+            return (att, "-inf", "%f" % v)
         elif op == 'gt':
-            members = zset.gt(v, limit, offset)
+            return (att, "(%f" % v, "+inf")
         elif op == 'gte':
-            members = zset.ge(v, limit, offset)
-        elif op == 'le':
-            members = zset.le(v, limit, offset)
-        elif op == 'lte':
-            members = zset.le(v, limit, offset)
-        elif op == 'in':
-            members = zset.between(min, max, limit, offset)
-
-        temp_set = Set(new_set_key_temp)
-        if members:
-            temp_set.add(*members)
-        temp_set.set_expire()
-
-        s.intersection(new_set_key, temp_set)
-        new_set = Set(new_set_key)
-        new_set.set_expire()
-        return new_set
+            return (att, "%f" % v, "+inf")
+        raise ValueError("Unknown zfilter operator %s." % op)
 
     def _order(self, skey):
         """
         This function does not job. It will only call the good
         subfunction in case we want an ordering or not.
         """
-        if self._ordering:
+        if self._view_range():
+            return self._set_with_view_ordering(skey)
+        elif self._ordering:
             return self._set_with_ordering(skey)
+        elif self._search and self._search[2]:
+            return self._set_with_rank(skey)
+        elif self._unordered and self._limit is None:
+            return Set(skey, db=self.db)
         else:
             return self._set_without_ordering(skey)
 
@@ -412,28 +1837,147 @@ class ModelSet(Set):
 
         :return: a Set of `id`
         """
+        if len(self._ordering) > 1:
+            return self._set_with_multiple_ordering(skey)
         num, start = self._get_limit_and_offset()
-        old_set_key = skey
+        ordering, alpha = self._ordering[0]
+        desc = ordering.startswith('-')
+        ordering = ordering.lstrip('-')
+        new_set_key = "%s#%s.%s" % (skey, ordering, id(self))
+        if self._is_zindexed(ordering):
+            return self._set_with_zindex_ordering(skey, new_set_key,
+                                                  ordering, desc)
+        by = "%s->%s" % (self.model_class._key['*'], ordering)
+        pipeline = self.db.pipeline()
+        pipeline.sort(skey,
+                      by=by,
+                      store=new_set_key,
+                      alpha=alpha,
+                      start=start,
+                      num=num,
+                      desc=desc)
+        if self._is_temporary(skey):
+            Set(skey, pipeline=pipeline).set_expire()
+        List(new_set_key, pipeline=pipeline).set_expire()
+        pipeline.execute()
+        return List(new_set_key, db=self.db)
+
+    def _set_with_multiple_ordering(self, skey):
+        """
+        Order the looked-up collection on several fields at once.
+        SORT only accepts one BY pattern, so the sort (and the
+        limit) is done by a script reading the hash of every object.
+
+        :return: a List of `id`
+        """
+        num, start = self._get_limit_and_offset()
+        fields = [ordering.lstrip('-') for ordering, alpha in self._ordering]
+        new_set_key = "%s#%s.%s" % (skey, ",".join(fields), id(self))
+        args = ["%s:" % self.model_class._key,
+                redisco.default_expire_time,
+                start or 0,
+                -1 if num is None else num]
         for ordering, alpha in self._ordering:
-            if ordering.startswith('-'):
-                desc = True
-                ordering = ordering.lstrip('-')
+            args.extend([ordering.lstrip('-'),
+                         int(alpha),
+                         int(ordering.startswith('-'))])
+        run_script(self.db, MULTISORT, keys=[skey, new_set_key], args=args)
+        if self._is_temporary(skey):
+            Set(skey, db=self.db).set_expire()
+        return List(new_set_key, db=self.db)
+
+    def _set_with_zindex_ordering(self, skey, new_set_key, field, desc):
+        """
+        Order the looked-up collection with the sorted set index of
+        ``field`` instead of sorting by the hash values: the filtered
+        set is intersected with the index (the ids keep the score of
+        the index) and only the requested page is stored, as in the
+        index order.
+
+        Objects without any value for ``field`` are not part of the
+        index and get a score of 0, as they would with SORT.
+
+        When the collection is not filtered and every object has a
+        value, the page is read from the index in place.
+
+        :return: a List of `id`
+        """
+        num, start = self._get_limit_and_offset()
+        new_list = List(new_set_key, db=self.db)
+        if skey == self.key:
+            index = self.model_class._key[field]
+            first = start or 0
+            last = -1 if num is None else first + num - 1
+            pipeline = self.db.pipeline()
+            pipeline.zcard(index)
+            pipeline.scard(skey)
+            if desc:
+                pipeline.zrevrange(index, first, last)
             else:
-                desc = False
-            new_set_key = "%s#%s.%s" % (old_set_key, ordering, id(self))
-            by = "%s->%s" % (self.model_class._key['*'], ordering)
-            self.db.sort(old_set_key,
-                         by=by,
-                         store=new_set_key,
-                         alpha=alpha,
-                         start=start,
-                         num=num,
-                         desc=desc)
-            if old_set_key != self.key:
-                Set(old_set_key, db=self.db).set_expire()
-            new_list = List(new_set_key, db=self.db)
-            new_list.set_expire()
-            return new_list
+                pipeline.zrange(index, first, last)
+            total, size, ids = pipeline.execute()
+            if total == size:
+                pipeline = self.db.pipeline()
+                pipeline.delete(new_set_key)
+                if ids:
+                    pipeline.rpush(new_set_key, *ids)
+                    List(new_set_key, pipeline=pipeline).set_expire()
+                pipeline.execute()
+                return new_list
+        zset_key = "%s#%s.z.%s" % (skey, field, id(self))
+        pipeline = self.db.pipeline()
+        pipeline.zinterstore(zset_key, {skey: 0,
+                                        self.model_class._key[field]: 1})
+        pipeline.zunionstore(zset_key, {skey: 0, zset_key: 1})
+        pipeline.sort(zset_key,
+                      by='nosort',
+                      store=new_set_key,
+                      start=start,
+                      num=num,
+                      desc=desc)
+        pipeline.delete(zset_key)
+        if self._is_temporary(skey):
+            Set(skey, pipeline=pipeline).set_expire()
+        List(new_set_key, pipeline=pipeline).set_expire()
+        pipeline.execute()
+        return new_list
+
+    def _set_with_rank(self, skey):
+        """
+        Order the results of a search by decreasing score. The weighted
+        union of the term frequency sorted sets (or of the word sets)
+        of the words is intersected with the looked-up collection and
+        only the requested page is stored.
+
+        :return: a List of `id`
+        """
+        num, start = self._get_limit_and_offset()
+        terms, fields, rank = self._search
+        sources = {}
+        for term in terms:
+            for att, weight in fields.iteritems():
+                desc = self.model_class._attributes[att]
+                prefix = '_tf' if desc.term_frequency else '_ft'
+                sources[self.model_class._key[prefix][att][term]] = weight
+        zset_key = "%s#rank.z.%s" % (skey, id(self))
+        new_set_key = "%s#rank.%s" % (skey, id(self))
+        pipeline = self.db.pipeline()
+        if sources:
+            pipeline.zunionstore(zset_key, sources)
+        pipeline.zinterstore(zset_key, {skey: 0, zset_key: 1})
+        pipeline.sort(zset_key,
+                      by='nosort',
+                      store=new_set_key,
+                      start=start,
+                      num=num,
+                      desc=True)
+        pipeline.delete(zset_key)
+        if self._is_temporary(skey):
+            Set(skey, pipeline=pipeline).set_expire()
+        new_list = List(new_set_key, db=self.db)
+        List(new_set_key, pipeline=pipeline).set_expire()
+        pipeline.execute()
+        return new_list
 
     def _set_without_ordering(self, skey):
         """
@@ -446,15 +1990,133 @@ class ModelSet(Set):
         num, start = self._get_limit_and_offset()
         old_set_key = skey
         new_set_key = "%s#.%s" % (old_set_key, id(self))
-        self.db.sort(old_set_key,
-                     store=new_set_key,
-                     start=start,
-                     num=num)
-        if old_set_key != self.key:
-            Set(old_set_key, db=self.db).set_expire()
-        new_list = List(new_set_key, db=self.db)
-        new_list.set_expire()
-        return new_list
+        pipeline = self.db.pipeline()
+        pipeline.sort(old_set_key,
+                      store=new_set_key,
+                      start=start,
+                      num=num)
+        if self._is_temporary(old_set_key):
+            Set(old_set_key, pipeline=pipeline).set_expire()
+        List(new_set_key, pipeline=pipeline).set_expire()
+        pipeline.execute()
+        return List(new_set_key, db=self.db)
+
+    def _page(self, cursor, n, backward):
+        """
+        Internals of ``after`` and ``before``. The cursor is made of
+        the score and the id of the last object returned.
+        """
+        if len(self._ordering) != 1 or \
+                not self._is_zindexed(self._ordering[0][0].lstrip('-')):
+            raise ValueError("Pagination needs an ordering on a single "
+                             "numeric or date attribute.")
+        field = self._ordering[0][0]
+        score, id = ('', '') if cursor is None else cursor.split(':', 1)
+        # walking backward on a descending order means going up the index
+        reverse = field.startswith('-') != backward
+        s = self._filtered_set()
+        res = run_script(self.db, KEYSET,
+                         keys=[self.model_class._key[field.lstrip('-')],
+                               s.key],
+                         args=[score, id, n, int(reverse), max(n, 100)])
+        ids, scores = res[::2], res[1::2]
+        if not ids:
+            return [], cursor
+        cursor = "%s:%s" % (scores[-1], ids[-1])
+        if backward:
+            ids.reverse()
+        return self._get_items_with_ids(ids), cursor
+
+    def _first_ids(self, reverse):
+        """
+        Internals of ``first`` and ``last``: return a list with the id
+        of the first object (the last one when ``reverse`` is True), or
+        an empty list, when it can be read without sorting and storing
+        the collection. Returns None otherwise, as for limited
+        collections.
+
+        Unordered collections are sorted by id, which SORT does
+        without storing anything. An index on a single ordering field
+        is read in place when the collection is not filtered and
+        every object has a value: the others would come first, with a
+        score of 0.
+        """
+        if (self._search and self._search[2]) or len(self._ordering) > 1 \
+                or self._limit is not None:
+            return None
+        field, desc = None, reverse
+        if self._ordering:
+            ordering = self._ordering[0][0]
+            field = ordering.lstrip('-')
+            if not self._is_zindexed(field) or self._has_filters():
+                return None
+            desc = ordering.startswith('-') != reverse
+        s = self._filtered_set()
+        pipeline = self.db.pipeline()
+        if field is None:
+            pipeline.sort(s.key, start=0, num=1, desc=desc)
+        else:
+            zkey = self.model_class._key[field]
+            if desc:
+                pipeline.zrevrange(zkey, 0, 0)
+            else:
+                pipeline.zrange(zkey, 0, 0)
+            pipeline.zcard(zkey)
+            pipeline.scard(s.key)
+        if self._is_temporary(s.key):
+            Set(s.key, pipeline=pipeline).set_expire()
+        res = pipeline.execute()
+        if field is not None and res[1] != res[2]:
+            return None
+        return res[0]
+
+    def _extreme(self, field, desc):
+        """
+        Internals of ``earliest`` and ``latest``. The index is walked
+        until an object of the collection is found (the whole index
+        when the filter is selective), unless the collection is not
+        filtered. The partitions of a partitioned
+        index are read in turn.
+        """
+        key = self.model_class._key[field]
+        if self._is_partitioned(field):
+            # from the first partition to the last one
+            if desc:
+                names = self.db.zrevrange(key['_partitions'], 0, -1)
+            else:
+                names = self.db.zrange(key['_partitions'], 0, -1)
+            zkeys = [key['_p'][name] for name in names]
+        elif self._is_zindexed(field):
+            zkeys = [key]
+        else:
+            raise AttributeNotIndexed(
+                    "Attribute %s has no sorted set index in %s class." %
+                    (field, self.model_class.__name__))
+        s = self._filtered_set()
+        for zkey in zkeys:
+            if s.key == self.key:
+                if desc:
+                    ids = self.db.zrevrange(zkey, 0, 0)
+                else:
+                    ids = self.db.zrange(zkey, 0, 0)
+            else:
+                ids = run_script(self.db, KEYSET, keys=[zkey, s.key],
+                                 args=['', '', 1, int(desc), 100])[::2]
+            if ids:
+                return self._get_item_with_id(ids[0])
+        return None
+
+    def _slice_bounds(self, index):
+        """
+        Return the ``(start, stop)`` bounds of the slice ``index`` when
+        they can be pushed down (``stop`` may be None), or None.
+        """
+        if index.step not in (None, 1):
+            return None
+        start = 0 if index.start is None else index.start
+        if start < 0 or (index.stop is not None and index.stop < 0):
+            return None
+        return start, index.stop
 
     def _get_limit_and_offset(self):
         """
@@ -469,6 +2131,61 @@ class ModelSet(Set):
         else:
             return (self._limit, self._offset)
 
+    def _is_zindexed(self, att):
+        """
+        Return True if ``att`` has an up to date sorted set index.
+        Counters are left out since their index is only updated
+        when the object is saved, and so are the partitioned
+        attributes, whose index is split.
+        """
+        desc = self.model_class._attributes.get(att)
+        return (isinstance(desc, ZINDEXABLE) and
+                not isinstance(desc, Counter) and
+                not self._is_partitioned(att))
+
+    def _is_partitioned(self, att):
+        """
+        Return True if the sorted set index of ``att`` is split into
+        partitions (see ``DateTimeField``).
+        """
+        desc = self.model_class._attributes.get(att)
+        return isinstance(desc, DateTimeField) and bool(desc.partition)
+
+    def _partitions_between(self, att, min, max):
+        """
+        Return the keys of the partitions of the index of ``att``
+        which may hold scores between the ZRANGEBYSCORE bounds ``min``
+        and ``max``. They are found in the registry of the partitions,
+        scored by their start.
+        """
+        desc = self.model_class._attributes[att]
+        key = self.model_class._key[att]
+        if min == '-inf':
+            lowest = '-inf'
+        else:
+            lowest = float(min.lstrip('(')) - desc.partition_length()
+        highest = max.lstrip('(')
+        return [key['_p'][name] for name in
+                self.db.zrangebyscore(key['_partitions'], lowest, highest)]
+
+    def _delete_ids(self, ids):
+        """
+        Internals of ``delete``: delete the objects ``ids`` with a
+        single script and return the number of objects deleted.
+        """
+        model = self.model_class
+        uniques = sorted(att for att, desc in model._attributes.iteritems()
+                         if desc.unique)
+        keys = [model._key['all']]
+        keys.extend(model._key['_unique'][att] for att in uniques)
+        for id in ids:
+            key = model._key[id]
+            keys.extend([key, key['_indices'], key['_zindices'],
+                         key['_lexindices']])
+            keys.extend(key[att] for att in sorted(model._lists))
+        args = [len(model._lists), len(uniques)] + uniques + list(ids)
+        return int(run_script(self.db, DELETE, keys=keys, args=args))
+
     def _get_item_with_id(self, id):
         """
         Fetch an object and return the instance. The real fetching is
@@ -478,6 +2195,21 @@ class ModelSet(Set):
         instance.id = str(id)
         return instance
 
+    def _get_items_with_ids(self, ids):
+        """
+        Fetch several objects in a single pipeline and return the
+        list of instances, in the order of ``ids``.
+        """
+        pipeline = self.db.pipeline()
+        for id in ids:
+            pipeline.hgetall(self.model_class._key[id])
+        items = []
+        for id, stored_attrs in zip(ids, pipeline.execute()):
+            instance = self.model_class()
+            instance._set_id(id, stored_attrs)
+            items.append(instance)
+        return items
+
     def _build_key_from_filter_item(self, index, value):
         """
         Build the keys from the filter so we can fetch the good keys
@@ -491,6 +2223,32 @@ class ModelSet(Set):
             value = desc.typecast_for_storage(value)
         return self.model_class._key[index][value]
 
+    def _build_key_from_compound(self, atts, values):
+        """
+        Build the key of the compound index of ``atts`` for
+        ``values``.
+        Example:
+            Foo.objects.filter(tenant='a', status='open')
+            => 'Foo:tenant+status:1:a:4:open'
+        """
+        key = self.model_class._key['+'.join(atts)]
+        for att, value in zip(atts, values):
+            desc = self.model_class._attributes.get(att)
+            if desc:
+                value = desc.typecast_for_storage(value)
+            else:
+                value = unicode(value)
+            key = key[len(value)][value]
+        return key
+
+    def _is_temporary(self, key):
+        """
+        Whether ``key`` holds a looked-up set that should expire.
+        These keys start with ``~``: the collection and the indices,
+        which can also be returned as looked-up sets, never do.
+        """
+        return key.startswith('~')
+
     def _clone(self):
         """
         This function allows the chaining of lookup calls.
@@ -501,14 +2259,68 @@ class ModelSet(Set):
         """
         klass = self.__class__
         c = klass(self.model_class)
-        if self._filters:
-            c._filters = self._filters
-        if self._exclusions:
-            c._exclusions = self._exclusions
-        if self._zfilters:
-            c._zfilters = self._zfilters
-        if self._ordering:
-            c._ordering = self._ordering
+        c._filters = dict(self._filters)
+        c._exclusions = dict(self._exclusions)
+        c._zfilters = list(self._zfilters)
+        c._qfilters = list(self._qfilters)
+        c._ordering = list(self._ordering)
         c._limit = self._limit
         c._offset = self._offset
+        c._unordered = self._unordered
+        c._search = self._search
+        c._combination = self._combination
+        c._view = self._view
+        c._view_ordering = self._view_ordering
         return c
+
+
+def _tracing_client(db, commands):
+    """
+    Return a copy of the client ``db`` which appends to ``commands``
+    the commands it sends, as one list per round trip (the commands
+    of a pipeline are sent together).
+    """
+    class TracingClient(db.__class__):
+        def execute_command(self, *args, **options):
+            commands.append([args])
+            return super(TracingClient, self).execute_command(*args,
+                                                              **options)
+
+        def pipeline(self, *args, **kwargs):
+            pipeline = super(TracingClient, self).pipeline(*args, **kwargs)
+            execute = pipeline.execute
+
+            def traced_execute(*args, **kwargs):
+                if pipeline.command_stack:
+                    commands.append([c[0] for c in pipeline.command_stack])
+                return execute(*args, **kwargs)
+            pipeline.execute = traced_execute
+            return pipeline
+
+    client = copy.copy(db)
+    client.__class__ = TracingClient
+    return client
+
+
+def _format_command(args):
+    """Format the arguments of a command as they would be typed."""
+    return u" ".join(a if isinstance(a, unicode) else
+                     str(a).decode('utf-8', 'replace') for a in args)
+
+
+def _score_between(score, min, max):
+    """Whether ``score`` is between the ZRANGEBYSCORE bounds."""
+    def above(bound):
+        if bound == '-inf':
+            return True
+        if bound.startswith('('):
+            return score > float(bound[1:])
+        return score >= float(bound)
+
+    def below(bound):
+        if bound == '+inf':
+            return True
+        if bound.startswith('('):
+            return score < float(bound[1:])
+        return score <= float(bound)
+    return above(min) and below(max)
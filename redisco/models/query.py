@@ -0,0 +1,67 @@
+"""
+Composable lookups for ``filter`` and ``exclude``.
+"""
+
+__all__ = ['Q']
+
+
+class Q(object):
+    """
+    Encapsulates lookups that can be combined with ``|`` (or), ``&``
+    (and) and negated with ``~`` before being given to ``filter`` or
+    ``exclude``. The lookups of a single ``Q`` are and-ed together.
+
+    >>> from redisco import models
+    >>> class Foo(models.Model):
+    ...     name = models.Attribute()
+    ...     size = models.IntegerField()
+    ...
+    >>> [Foo(name=n, size=s).save() for n, s in (("a", 1), ("b", 2), ("c", 3))]
+    [True, True, True]
+    >>> [f.name for f in Foo.objects.filter(models.Q(name="a") | models.Q(size=3))]
+    [u'a', u'c']
+    >>> [f.name for f in Foo.objects.filter(~models.Q(name="a"), ~models.Q(size=3))]
+    [u'b']
+    >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+    [...]
+    """
+    AND = 'AND'
+    OR = 'OR'
+
+    def __init__(self, **kwargs):
+        self.connector = self.AND
+        self.negated = False
+        self.children = sorted(kwargs.items())
+
+    def _combine(self, other, connector):
+        if not isinstance(other, Q):
+            raise TypeError("Can only combine a Q with another Q.")
+        q = Q()
+        q.connector = connector
+        q.children = [self, other]
+        return q
+
+    def __or__(self, other):
+        return self._combine(other, self.OR)
+
+    def __and__(self, other):
+        return self._combine(other, self.AND)
+
+    def __invert__(self):
+        q = Q()
+        q.connector = self.connector
+        q.children = self.children
+        q.negated = not self.negated
+        return q
+
+    def __repr__(self):
+        children = []
+        for child in self.children:
+            if isinstance(child, Q):
+                children.append(repr(child))
+            else:
+                children.append("%s=%r" % child)
+        s = "(%s: %s)" % (self.connector, ", ".join(children))
+        if self.negated:
+            return "(NOT %s)" % s
+        return s
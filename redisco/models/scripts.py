@@ -0,0 +1,310 @@
+"""
+Lua scripts used to run the heavy parts of the queries inside Redis.
+"""
+
+# Number of arguments pushed to a single variadic command from a script.
+# Lua's unpack() is limited by the size of the C stack.
+_CHUNK = 1000
+
+
+def run_script(db, source, keys=None, args=None, client=None):
+    """
+    Run ``source`` against ``db`` using EVALSHA (the script is loaded
+    on the first call). When ``client`` is a pipeline, the call is only
+    queued.
+
+    Some scripts also use keys they do not receive in ``keys``, as their
+    names are only known once other keys are read: the hashes of the
+    objects sorted by MULTISORT, the index sets counted by FACET and the
+    indices recorded in the bookkeeping keys of the objects removed by
+    DELETE. They need every key to be on a single server, and do not
+    work with Redis Cluster or with proxies routing the commands by key.
+    """
+    script = db.register_script(source)
+    return script(keys=keys or [], args=args or [], client=client)
+
+
+# Stores the intersection of KEYS[2] with the members of the sorted set
+# KEYS[1] whose score is between ARGV[1] and ARGV[2] into KEYS[3].
+# KEYS[3] expires after ARGV[3] seconds.
+ZRANGESTORE = """
+local members = redis.call('ZRANGEBYSCORE', KEYS[1], ARGV[1], ARGV[2])
+redis.call('DEL', KEYS[3])
+for i = 1, #members, %(chunk)d do
+    redis.call('SADD', KEYS[3], unpack(members, i, math.min(i + %(chunk)d - 1, #members)))
+end
+local n = redis.call('SINTERSTORE', KEYS[3], KEYS[3], KEYS[2])
+redis.call('EXPIRE', KEYS[3], ARGV[3])
+return n
+""" % {'chunk': _CHUNK}
+
+
+# Sorts the ids of the set KEYS[1] on several fields of their hash
+# (prefixed by ARGV[1]) and stores the page starting at ARGV[3] and of
+# ARGV[4] elements (-1 for all of them) into the list KEYS[2], which
+# expires after ARGV[2] seconds.
+# Each field is given by three arguments: its name, 1 if it should be
+# compared as a string (0 as a number) and 1 for a descending order.
+# The remaining ties are ordered by id.
+MULTISORT = """
+local fields, alphas, descs = {}, {}, {}
+for i = 5, #ARGV, 3 do
+    fields[#fields + 1] = ARGV[i]
+    alphas[#alphas + 1] = ARGV[i + 1] == '1'
+    descs[#descs + 1] = ARGV[i + 2] == '1'
+end
+local rows = {}
+for n, id in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    local values = redis.call('HMGET', ARGV[1] .. id, unpack(fields))
+    local row = {id = id, num = tonumber(id) or 0}
+    for i = 1, #fields do
+        if alphas[i] then
+            row[i] = values[i] or ''
+        else
+            row[i] = tonumber(values[i]) or 0
+        end
+    end
+    rows[n] = row
+end
+table.sort(rows, function(a, b)
+    for i = 1, #fields do
+        if a[i] ~= b[i] then
+            if descs[i] then
+                return a[i] > b[i]
+            end
+            return a[i] < b[i]
+        end
+    end
+    return a.num < b.num
+end)
+local start = tonumber(ARGV[3])
+local stop = #rows
+if tonumber(ARGV[4]) >= 0 then
+    stop = math.min(stop, start + tonumber(ARGV[4]))
+end
+redis.call('DEL', KEYS[2])
+for i = start + 1, stop, %(chunk)d do
+    local page = {}
+    for j = i, math.min(i + %(chunk)d - 1, stop) do
+        page[#page + 1] = rows[j].id
+    end
+    redis.call('RPUSH', KEYS[2], unpack(page))
+end
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return math.max(stop - start, 0)
+""" % {'chunk': _CHUNK}
+
+
+# Returns the next ARGV[3] members of the sorted set KEYS[1], as a flat
+# list of members and scores, that are also in the set KEYS[2].
+# The walk starts right after the member ARGV[2] of score ARGV[1] (or
+# at the beginning when ARGV[1] is empty), goes down the scores when
+# ARGV[4] is '1' and reads the sorted set ARGV[5] members at a time.
+# Finding the start is O(log n), but every member walked is checked
+# against KEYS[2]: a small KEYS[2] may make the walk read the whole
+# sorted set.
+KEYSET = """
+local reverse = ARGV[4] == '1'
+local range, rank = 'ZRANGE', 'ZRANK'
+if reverse then
+    range, rank = 'ZREVRANGE', 'ZREVRANK'
+end
+local pos, cscore = 0, nil
+if ARGV[1] ~= '' then
+    cscore = tonumber(ARGV[1])
+    local score = redis.call('ZSCORE', KEYS[1], ARGV[2])
+    if score and tonumber(score) == cscore then
+        pos = redis.call(rank, KEYS[1], ARGV[2]) + 1
+        cscore = nil
+    elseif reverse then
+        pos = redis.call('ZCOUNT', KEYS[1], '(' .. ARGV[1], '+inf')
+    else
+        pos = redis.call('ZCOUNT', KEYS[1], '-inf', '(' .. ARGV[1])
+    end
+end
+local n, batch = tonumber(ARGV[3]), tonumber(ARGV[5])
+local res = {}
+while #res < 2 * n do
+    local members = redis.call(range, KEYS[1], pos, pos + batch - 1, 'WITHSCORES')
+    if #members == 0 then
+        break
+    end
+    for i = 1, #members, 2 do
+        local member, score = members[i], members[i + 1]
+        -- the cursor has moved: skip the ties that were already seen
+        local seen = cscore ~= nil and tonumber(score) == cscore and
+            ((not reverse and member <= ARGV[2]) or
+             (reverse and member >= ARGV[2]))
+        if not seen and redis.call('SISMEMBER', KEYS[2], member) == 1 then
+            res[#res + 1] = member
+            res[#res + 1] = score
+            if #res == 2 * n then
+                break
+            end
+        end
+    end
+    pos = pos + batch
+end
+return res
+"""
+
+
+# Stores the ids of the members of the lexicographic index KEYS[1]
+# between ARGV[1] and ARGV[2] (ZRANGEBYLEX bounds), intersected with
+# the set KEYS[2], into KEYS[3]. Members are the value and the id
+# separated by a NUL character. KEYS[3] expires after ARGV[3] seconds.
+LEXSTORE = """
+local members = redis.call('ZRANGEBYLEX', KEYS[1], ARGV[1], ARGV[2])
+redis.call('DEL', KEYS[3])
+local ids = {}
+for i, member in ipairs(members) do
+    ids[#ids + 1] = string.match(member, '%%z([^%%z]+)$')
+end
+for i = 1, #ids, %(chunk)d do
+    redis.call('SADD', KEYS[3], unpack(ids, i, math.min(i + %(chunk)d - 1, #ids)))
+end
+local n = redis.call('SINTERSTORE', KEYS[3], KEYS[3], KEYS[2])
+redis.call('EXPIRE', KEYS[3], ARGV[3])
+return n
+""" % {'chunk': _CHUNK}
+
+
+# Returns the number of members of the sorted set KEYS[1] and the sum
+# of their scores, both as strings (numbers returned by a script are
+# truncated to integers).
+ZSUM = """
+local n, total = 0, 0
+local size = redis.call('ZCARD', KEYS[1])
+for i = 0, size - 1, %(chunk)d do
+    local members = redis.call('ZRANGE', KEYS[1], i, i + %(chunk)d - 1, 'WITHSCORES')
+    for j = 2, #members, 2 do
+        total = total + tonumber(members[j])
+    end
+    n = n + #members / 2
+end
+return {tostring(n), string.format('%%.17g', total)}
+""" % {'chunk': _CHUNK}
+
+
+# Returns, as a flat list of values and counts, the number of members
+# of the set KEYS[2] in the index set (prefixed by ARGV[1]) of each
+# value of the set KEYS[1]. Values with no index set left are removed
+# from KEYS[1], values with no member in KEYS[2] are not returned.
+# KEYS[3] is used to count the members, unless ARGV[2] is '1': KEYS[2]
+# then holds every object and the index sets are counted as they are.
+FACET = """
+local res = {}
+for i, value in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    local index = ARGV[1] .. value
+    if redis.call('EXISTS', index) == 0 then
+        redis.call('SREM', KEYS[1], value)
+    else
+        local n
+        if ARGV[2] == '1' then
+            n = redis.call('SCARD', index)
+        else
+            n = redis.call('SINTERSTORE', KEYS[3], index, KEYS[2])
+        end
+        if n > 0 then
+            res[#res + 1] = value
+            res[#res + 1] = n
+        end
+    end
+end
+redis.call('DEL', KEYS[3])
+return res
+"""
+
+
+# Returns, for each object whose hash is one of KEYS after KEYS[1], the
+# values of its fields, or nil when the object is not in the set of all
+# objects KEYS[1]. ARGV[1] is the number of fields, followed by their
+# names and by the ids of the objects. An object may have no hash when
+# none of its attributes has a value: its fields are then all nil.
+HMGETS = """
+local nfields = tonumber(ARGV[1])
+local res = {}
+for i = 2, #KEYS do
+    if redis.call('SISMEMBER', KEYS[1], ARGV[i + nfields]) == 0 then
+        res[i - 1] = false
+    elseif nfields > 0 then
+        res[i - 1] = redis.call('HMGET', KEYS[i], unpack(ARGV, 2, 1 + nfields))
+    else
+        res[i - 1] = {}
+    end
+end
+return res
+"""
+
+
+# Claims the values of the unique attributes of the object ARGV[1],
+# whose hash is the last key, in the hashes of the unique values KEYS
+# (one for each attribute). ARGV then gives the name and the value of
+# each attribute, an empty value only releasing the previous value.
+# Nothing is claimed if a value belongs to another object: the name of
+# its attribute is returned.
+UNIQUE = """
+local key, id = KEYS[#KEYS], ARGV[1]
+for i = 1, #KEYS - 1 do
+    local value = ARGV[2 * i + 1]
+    if value ~= '' then
+        local owner = redis.call('HGET', KEYS[i], value)
+        if owner and owner ~= id then
+            return ARGV[2 * i]
+        end
+    end
+end
+for i = 1, #KEYS - 1 do
+    local value = ARGV[2 * i + 1]
+    local old = redis.call('HGET', key, ARGV[2 * i])
+    if old and old ~= value and redis.call('HGET', KEYS[i], old) == id then
+        redis.call('HDEL', KEYS[i], old)
+    end
+    if value ~= '' then
+        redis.call('HSET', KEYS[i], value, id)
+    end
+end
+return false
+"""
+
+
+# Deletes the objects whose ids are given after the unique attributes
+# of the model: ARGV[1] is the number of list fields and ARGV[2] the
+# number of unique attributes, followed by their names. KEYS[1] is the
+# set of all objects, followed by the hashes of the unique values of
+# each attribute, then, for each object, its hash, its bookkeeping keys
+# (_indices, _zindices and _lexindices) and its lists.
+# The objects are removed from the indices recorded in their
+# bookkeeping keys (which are not declared), from the hashes of the
+# unique values and from KEYS[1]. Returns the number of objects that
+# were in KEYS[1].
+DELETE = """
+local nlists, nuniques = tonumber(ARGV[1]), tonumber(ARGV[2])
+local size = 4 + nlists
+local n = 0
+for i = 3 + nuniques, #ARGV do
+    local id = ARGV[i]
+    local first = 2 + nuniques + (i - 3 - nuniques) * size
+    local key = KEYS[first]
+    for j = 1, nuniques do
+        local unique = KEYS[1 + j]
+        local value = redis.call('HGET', key, ARGV[2 + j])
+        if value and redis.call('HGET', unique, value) == id then
+            redis.call('HDEL', unique, value)
+        end
+    end
+    for _, index in ipairs(redis.call('SMEMBERS', KEYS[first + 1])) do
+        redis.call('SREM', index, id)
+    end
+    for _, index in ipairs(redis.call('SMEMBERS', KEYS[first + 2])) do
+        redis.call('ZREM', index, id)
+    end
+    local lex = redis.call('HGETALL', KEYS[first + 3])
+    for j = 1, #lex, 2 do
+        redis.call('ZREM', lex[j], lex[j + 1])
+    end
+    redis.call('DEL', unpack(KEYS, first, first + size - 1))
+    n = n + redis.call('SREM', KEYS[1], id)
+end
+return n
+"""